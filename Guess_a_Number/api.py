@@ -15,6 +15,8 @@ from models import User, Game, Score
 from models import StringMessage, NewGameForm, GameForm, MakeMoveForm,\
     ScoreForms
 from utils import get_by_urlsafe
+from cache import entity_cache
+import latency
 
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(
@@ -35,6 +37,7 @@ class GuessANumberApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @latency.timed
     def create_user(self, request):
         """Create a User. Requires a unique username"""
         if User.query(User.name == request.user_name).get():
@@ -50,6 +53,7 @@ class GuessANumberApi(remote.Service):
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @latency.timed
     def new_game(self, request):
         """Creates new game"""
         user = User.query(User.name == request.user_name).get()
@@ -74,9 +78,10 @@ class GuessANumberApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @latency.timed
     def get_game(self, request):
         """Return the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game = get_by_urlsafe(request.urlsafe_game_key, Game, entity_cache)
         if game:
             return game.to_form('Time to make a move!')
         else:
@@ -87,6 +92,7 @@ class GuessANumberApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @latency.timed
     def make_move(self, request):
         """Makes a move. Returns a game state with message"""
         game = get_by_urlsafe(request.urlsafe_game_key, Game)
@@ -114,6 +120,7 @@ class GuessANumberApi(remote.Service):
                       path='scores',
                       name='get_scores',
                       http_method='GET')
+    @latency.timed
     def get_scores(self, request):
         """Return all scores"""
         return ScoreForms(items=[score.to_form() for score in Score.query()])
@@ -123,6 +130,7 @@ class GuessANumberApi(remote.Service):
                       path='scores/user/{user_name}',
                       name='get_user_scores',
                       http_method='GET')
+    @latency.timed
     def get_user_scores(self, request):
         """Returns all of an individual User's scores"""
         user = User.query(User.name == request.user_name).get()
@@ -136,6 +144,7 @@ class GuessANumberApi(remote.Service):
                       path='games/average_attempts',
                       name='get_average_attempts_remaining',
                       http_method='GET')
+    @latency.timed
     def get_average_attempts(self, request):
         """Get the cached average moves remaining"""
         return StringMessage(message=memcache.get(MEMCACHE_MOVES_REMAINING) or '')
@@ -0,0 +1,127 @@
+"""cache.py - Two-tier read-through cache for entities fetched by key.
+
+A lookup tries a small per-instance LRU first, then memcache, then the
+datastore, filling the tiers it missed on the way back. Keys with no entity
+are cached too, so polling a deleted game does not reach the datastore. The
+LRU holds entries for a short TTL because other instances cannot invalidate
+it; models call invalidate() from their put and delete hooks to clear the
+local tier and memcache.
+
+A miss fills memcache under a lease: it adds a LEASE placeholder before
+reading the datastore and compare-and-sets the entity over it afterwards.
+invalidate() deletes the placeholder with the entry, so a reader that
+fetched the entity just before a write commits cannot cache the old one
+after the write has invalidated it; its compare-and-set fails instead."""
+
+import collections
+import pickle
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+
+LOCAL_SIZE = 1000
+LOCAL_TTL_SECONDS = 1
+MEMCACHE_TTL_SECONDS = 600
+MEMCACHE_PREFIX = 'ENTITY-'
+# cached in place of an entity for keys that have none
+MISSING = b''
+# held in memcache by a reader filling the entry; pickles never equal it
+LEASE = b'LEASE'
+LEASE_SECONDS = 10
+
+
+class EntityCache(object):
+    """Read-through cache of entities by key"""
+
+    def __init__(self, size=LOCAL_SIZE, ttl=LOCAL_TTL_SECONDS,
+                 memcache_ttl=MEMCACHE_TTL_SECONDS):
+        self.size = size
+        self.ttl = ttl
+        self.memcache_ttl = memcache_ttl
+        self._lock = threading.Lock()
+        self._local = collections.OrderedDict()
+        self._stats = collections.Counter()
+
+    def _get_local(self, name):
+        with self._lock:
+            item = self._local.pop(name, None)
+            if item is None:
+                return None
+            expires, data = item
+            if expires < time.time():
+                return None
+            # re-insert to mark as most recently used
+            self._local[name] = item
+            return data
+
+    def _set_local(self, name, data):
+        with self._lock:
+            self._local.pop(name, None)
+            self._local[name] = (time.time() + self.ttl, data)
+            while len(self._local) > self.size:
+                self._local.popitem(last=False)
+
+    def get(self, key):
+        """Returns the entity for key, or None if there is none. Every call
+        returns a fresh copy, so callers may modify it."""
+        name = MEMCACHE_PREFIX + key.urlsafe()
+        data = self._get_local(name)
+        if data is not None:
+            self._stats['local_hits'] += 1
+        else:
+            client = memcache.Client()
+            data = client.gets(name)
+            if data is not None and data != LEASE:
+                self._stats['memcache_hits'] += 1
+            else:
+                self._stats['misses'] += 1
+                leased = data is None and client.add(name, LEASE,
+                                                     time=LEASE_SECONDS)
+                if leased:
+                    # the cas id of the placeholder
+                    leased = client.gets(name) == LEASE
+                entity = key.get()
+                data = (pickle.dumps(entity, pickle.HIGHEST_PROTOCOL)
+                        if entity is not None else MISSING)
+                # fails if the entity was invalidated since the lease
+                if leased and client.cas(name, data,
+                                         time=self.memcache_ttl):
+                    self._set_local(name, data)
+                return entity
+            self._set_local(name, data)
+        if data == MISSING:
+            self._stats['negative_hits'] += 1
+            return None
+        return pickle.loads(data)
+
+    def invalidate(self, key):
+        """Drops key from both tiers. Inside a transaction this waits for the
+        commit, so a concurrent read cannot cache the old entity again."""
+        name = MEMCACHE_PREFIX + key.urlsafe()
+
+        def drop():
+            with self._lock:
+                self._local.pop(name, None)
+            memcache.delete(name)
+
+        if ndb.in_transaction():
+            drop()
+            ndb.get_context().call_on_commit(drop)
+        else:
+            drop()
+
+    def clear(self):
+        """Empties the local tier and resets the counters"""
+        with self._lock:
+            self._local.clear()
+            self._stats.clear()
+
+    def stats(self):
+        """Returns the hit and miss counters"""
+        return dict(self._stats)
+
+
+entity_cache = EntityCache()
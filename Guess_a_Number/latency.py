@@ -0,0 +1,152 @@
+"""latency.py - Latency histograms of endpoint methods.
+
+timed() wraps an endpoint method and records the wall time, CPU time and
+response size of each call into fixed-bucket histograms kept per instance in
+memory. At most every FLUSH_SECONDS the next call adds the buckets filled
+since the last flush to counters in memcache with one offset_multi, so the
+counters hold the histograms of every instance and percentiles are read
+from them without touching the datastore. Response sizes are the length of
+the JSON encoding, measured for one call in SIZE_SAMPLE_EVERY."""
+
+import bisect
+import functools
+import logging
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.api import quota
+from protorpc import protojson
+
+
+FLUSH_SECONDS = 60
+SIZE_SAMPLE_EVERY = 10
+MEMCACHE_PREFIX = 'LATENCY-'
+PERCENTILES = (50, 95, 99)
+
+# upper bounds of the buckets; each is 25% above the previous one, so a
+# percentile read from the buckets is within 25% of the true value
+MS_BUCKETS = tuple(round(0.5 * 1.25 ** i, 2) for i in range(53))
+BYTE_BUCKETS = tuple(int(64 * 1.25 ** i) for i in range(55))
+METRICS = (('wall_ms', MS_BUCKETS),
+           ('cpu_ms', MS_BUCKETS),
+           ('bytes', BYTE_BUCKETS))
+BOUNDS = dict(METRICS)
+
+_lock = threading.Lock()
+# {(method, metric, bucket): count} since the last flush
+_pending = {}
+_last_flush = [time.time()]
+_calls = [0]
+
+
+def bucket(bounds, value):
+    """Returns the index of the bucket of value; values above the last
+    bound go in an overflow bucket"""
+    return bisect.bisect_left(bounds, value)
+
+
+def _record(method, values):
+    with _lock:
+        for metric, value in values:
+            key = (method, metric, bucket(BOUNDS[metric], value))
+            _pending[key] = _pending.get(key, 0) + 1
+        if time.time() - _last_flush[0] < FLUSH_SECONDS:
+            return
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush[0] = time.time()
+    flush(pending)
+
+
+def _name(method, metric, index):
+    return '{}{}-{}-{}'.format(MEMCACHE_PREFIX, method, metric, index)
+
+
+def flush(pending=None):
+    """Adds the buckets recorded since the last flush to memcache"""
+    if pending is None:
+        with _lock:
+            pending = dict(_pending)
+            _pending.clear()
+            _last_flush[0] = time.time()
+    if not pending:
+        return
+    offsets = dict((_name(*key), count) for key, count in pending.items())
+    if memcache.offset_multi(offsets, initial_value=0) is None:
+        logging.warning('dropped latency histograms of %d buckets',
+                        len(offsets))
+
+
+def timed(method):
+    """Decorates an endpoint method to record its wall time, CPU time and
+    response size"""
+    @functools.wraps(method)
+    def wrapper(self, request):
+        started = time.time()
+        cpu_started = quota.get_request_cpu_usage()
+        response = None
+        try:
+            response = method(self, request)
+            return response
+        finally:
+            values = [
+                ('wall_ms', (time.time() - started) * 1000),
+                ('cpu_ms', 1000 * quota.megacycles_to_cpu_seconds(
+                    quota.get_request_cpu_usage() - cpu_started))]
+            _calls[0] += 1
+            if response is not None and _calls[0] % SIZE_SAMPLE_EVERY == 0:
+                values.append(('bytes',
+                               len(protojson.encode_message(response))))
+            _record(method.__name__, values)
+    return wrapper
+
+
+def percentile(bounds, counts, p):
+    """Returns the upper bound of the bucket holding the p-th percentile of
+    a histogram, or None if it is empty. The overflow bucket has no upper
+    bound and reports the last one."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = p / 100.0 * total
+    seen = 0
+    for index, count in enumerate(counts):
+        seen += count
+        if seen >= rank:
+            return bounds[min(index, len(bounds) - 1)]
+
+
+def histograms(methods):
+    """Returns {method: {metric: [count per bucket]}} across instances,
+    read in one memcache call"""
+    names = [_name(method, metric, index)
+             for method in methods for metric, bounds in METRICS
+             for index in range(len(bounds) + 1)]
+    cached = memcache.get_multi(names)
+    return dict((method, dict(
+        (metric, [cached.get(_name(method, metric, index), 0)
+                  for index in range(len(bounds) + 1)])
+        for metric, bounds in METRICS)) for method in methods)
+
+
+def report(methods):
+    """Returns {method: {metric: {'count': n, 'p50': ..}}} across
+    instances"""
+    result = {}
+    for method, metrics in histograms(methods).items():
+        result[method] = {}
+        for metric, bounds in METRICS:
+            counts = metrics[metric]
+            summary = {'count': sum(counts)}
+            for p in PERCENTILES:
+                summary['p{}'.format(p)] = percentile(bounds, counts, p)
+            result[method][metric] = summary
+    return result
+
+
+def reset(methods):
+    """Drops the histograms of methods"""
+    memcache.delete_multi([_name(method, metric, index)
+                           for method in methods for metric, bounds in METRICS
+                           for index in range(len(bounds) + 1)])
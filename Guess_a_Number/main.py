@@ -7,6 +7,7 @@ import logging
 import webapp2
 from google.appengine.api import mail, app_identity
 from api import GuessANumberApi
+import latency
 
 from models import User
 
@@ -35,7 +36,31 @@ class UpdateAverageMovesRemaining(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class LatencyReport(webapp2.RequestHandler):
+    def get(self):
+        """Report the p50, p95 and p99 wall time, CPU time and response size
+        of each endpoint across instances. ?reset=1 clears them."""
+        latency.flush()
+        methods = sorted(GuessANumberApi.all_remote_methods())
+        report = latency.report(methods)
+        if self.request.get('reset'):
+            latency.reset(methods)
+        lines = ['{:<24}{:<10}{:>8}'.format('endpoint', 'metric', 'count') +
+                 ''.join('{:>10}'.format('p{}'.format(p))
+                         for p in latency.PERCENTILES)]
+        for method in methods:
+            for metric, _ in latency.METRICS:
+                summary = report[method][metric]
+                lines.append('{:<24}{:<10}{:>8}'.format(
+                    method, metric, summary['count']) + ''.join(
+                        '{:>10}'.format(summary['p{}'.format(p)])
+                        for p in latency.PERCENTILES))
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('\n'.join(lines) + '\n')
+
+
 app = webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail),
     ('/tasks/cache_average_attempts', UpdateAverageMovesRemaining),
+    ('/admin/latency', LatencyReport),
 ], debug=True)
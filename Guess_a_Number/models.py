@@ -7,6 +7,8 @@ from datetime import date
 from protorpc import messages
 from google.appengine.ext import ndb
 
+from cache import entity_cache
+
 
 class User(ndb.Model):
     """User profile"""
@@ -22,6 +24,13 @@ class Game(ndb.Model):
     game_over = ndb.BooleanProperty(required=True, default=False)
     user = ndb.KeyProperty(required=True, kind='User')
 
+    def _post_put_hook(self, future):
+        entity_cache.invalidate(self.key)
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        entity_cache.invalidate(key)
+
     @classmethod
     def new_game(cls, user, min, max, attempts):
         """Creates and returns a new game"""
@@ -4,7 +4,7 @@ import logging
 from google.appengine.ext import ndb
 import endpoints
 
-def get_by_urlsafe(urlsafe, model):
+def get_by_urlsafe(urlsafe, model, cache=None):
     """Returns an ndb.Model entity that the urlsafe key points to. Checks
         that the type of entity returned is of the correct kind. Raises an
         error if the key String is malformed or the entity is of the incorrect
@@ -12,6 +12,8 @@ def get_by_urlsafe(urlsafe, model):
     Args:
         urlsafe: A urlsafe key string
         model: The expected entity kind
+        cache: An optional cache.EntityCache to read through. Leave it out
+            for reads that are written back, or inside a transaction.
     Returns:
         The entity that the urlsafe Key string points to or None if no entity
         exists.
@@ -27,7 +29,7 @@ def get_by_urlsafe(urlsafe, model):
         else:
             raise
 
-    entity = key.get()
+    entity = cache.get(key) if cache else key.get()
     if not entity:
         return None
     if not isinstance(entity, model):
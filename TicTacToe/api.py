@@ -6,19 +6,26 @@ primarily with communication to/from the API's users."""
 
 
 from datetime import date, datetime
-import random
 import logging
 import endpoints
 from protorpc import remote, messages
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
 
-from models import User, Game, History, Score
+from models import User, Game, History, Score, LEGACY_USER_LOOKUP
 from models import StringMessage, UserForm, UserForms, \
     NewGameForm, GameForm, GameForms, CancelGameForm, \
     HistoryForm, HistoryForms, \
     MakeMoveForm, ScoreForms
-from utils import get_by_urlsafe
+from utils import get_by_urlsafe_async, schedule_coalesced_task_async, \
+    fetch_page_async, page_size, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+import engine
+import robot
+import counters
+import leaderboard
+from cache import entity_cache
+import hotstore
+import latency
+import rpcstats
 
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(
@@ -29,22 +36,37 @@ MAKE_MOVE_REQUEST = endpoints.ResourceContainer(
     MakeMoveForm,
     urlsafe_game_key=messages.StringField(1),)
 GET_GAME_HISTORY_REQUEST = endpoints.ResourceContainer(
-        urlsafe_game_key=messages.StringField(1))
+        urlsafe_game_key=messages.StringField(1),
+        page_size=messages.IntegerField(2),
+        page_token=messages.StringField(3))
 
 USER_REQUEST = endpoints.ResourceContainer(user_name=messages.StringField(1),
-                                           email=messages.StringField(2))
+                                           email=messages.StringField(2),
+                                           page_size=messages.IntegerField(3),
+                                           page_token=messages.StringField(4))
+PAGE_REQUEST = endpoints.ResourceContainer(page_size=messages.IntegerField(1),
+                                           page_token=messages.StringField(2))
+RANKINGS_REQUEST = endpoints.ResourceContainer(
+        top_n=messages.IntegerField(1),
+        page_token=messages.StringField(2),
+        user_name=messages.StringField(3),
+        window=messages.IntegerField(4))
 HIGH_SCORES_REQUEST = endpoints.ResourceContainer(number_of_results=messages.IntegerField(1))
 
 
 
 MEMCACHE_WIN_RATES = 'WIN_RATES'
+AVERAGE_WIN_RATES_URL = '/tasks/cache_average_win_rates'
+# seconds of new games folded into one average win rates recompute
+AVERAGE_WIN_RATES_WINDOW = 10
 
 
 
 
 @endpoints.api(name='tic_tac_toe', version='v1')
 class TicTacToeApi(remote.Service):
-    """Game API"""
+    """Game API. Each endpoint is a synchronous facade over a tasklet, so
+    the independent datastore and memcache calls of a request overlap."""
 
 
 
@@ -61,28 +83,87 @@ class TicTacToeApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @latency.timed
+    @rpcstats.accounted
     def create_user(self, request):
         """Create a User. Requires a unique username"""
-        if User.query(User.name == request.user_name).get():
+        return self._create_user_async(request).get_result()
+
+    @ndb.tasklet
+    def _create_user_async(self, request):
+        # users created before they were keyed by name can only be found
+        # by query until they are migrated
+        legacy = LEGACY_USER_LOOKUP and (yield User.query(
+            User.name == request.user_name).get_async(keys_only=True))
+        if legacy or not (yield User.create_async(request.user_name,
+                                                  request.email)):
             raise endpoints.ConflictException(
                     'A User with that name already exists!')
-        user = User(name=request.user_name, email=request.email, wins=0, total=0, rate=0)
-        user.put()
-        return StringMessage(message='User {} created!'.format(
-                request.user_name))
+        raise ndb.Return(StringMessage(message='User {} created!'.format(
+                request.user_name)))
 
 
 
 # GET USER RANKS ---------------------------
-    @endpoints.method(response_message=UserForms,
+    @endpoints.method(request_message=RANKINGS_REQUEST,
+                      response_message=UserForms,
                       path='user/rankings',
                       name='get_user_rankings',
                       http_method='GET')
+    @latency.timed
+    @rpcstats.accounted
     def get_user_rankings(self, request):
-        """Return all scores"""
-        return UserForms(items=[user.to_form() for user in User.query().order(-User.rate)])
-
-
+        """Return users ranked by win rate: the top_n from page_token on, or
+        with user_name, that user and window users either side of them"""
+        return self._get_user_rankings_async(request).get_result()
+
+    @ndb.tasklet
+    def _get_user_rankings_async(self, request):
+        if not request.user_name:
+            try:
+                start = int(request.page_token or 0)
+            except ValueError:
+                raise endpoints.BadRequestException('Invalid page token')
+            if start < 0:
+                raise endpoints.BadRequestException('Invalid page token')
+            if request.top_n is not None and request.top_n < 1:
+                raise endpoints.BadRequestException('top_n must be positive')
+            top_n = min(request.top_n or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        # the board and the user are read in parallel
+        user_future = (User.get_by_name_async(request.user_name)
+                       if request.user_name else None)
+        board = yield leaderboard.get_board_async()
+        if board is None:
+            users = yield User.query().order(-User.rate).fetch_async(
+                leaderboard.LEADERBOARD_SIZE)
+            board = leaderboard.rebuild(users)
+
+        if request.user_name:
+            user = yield user_future
+            if not user:
+                raise endpoints.NotFoundException(
+                        'A User with that name does not exist!')
+            rank = leaderboard.rank(board, leaderboard.entry(user))
+            if rank is None:
+                if request.window:
+                    raise endpoints.BadRequestException(
+                            'window is only served for users on the '
+                            'leaderboard')
+                # below the materialized board: count the users ahead
+                ahead = yield User.query(User.rate > user.rate).count_async()
+                raise ndb.Return(UserForms(items=[user.to_form(ahead + 1)]))
+            window = min(max(request.window or 0, 0), MAX_PAGE_SIZE)
+            start = max(rank - 1 - window, 0)
+            entries = board[start:rank + window]
+            next_page_token = None
+        else:
+            entries = board[start:start + top_n]
+            next_page_token = (str(start + top_n)
+                               if start + top_n < len(board) else None)
+        raise ndb.Return(UserForms(items=[UserForm(rank=start + i + 1,
+                                                   **leaderboard.fields(entry))
+                                          for i, entry in enumerate(entries)],
+                                   next_page_token=next_page_token))
 
 
 
@@ -93,20 +174,38 @@ class TicTacToeApi(remote.Service):
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @latency.timed
+    @rpcstats.accounted
     def new_game(self, request):
         """Creates new game"""
-        user = User.query(User.name == request.user_name).get()
+        return self._new_game_async(request).get_result()
+
+    @ndb.tasklet
+    def _new_game_async(self, request):
+        if not engine.MIN_SIZE <= request.size <= engine.MAX_SIZE:
+            raise endpoints.BadRequestException(
+                    'size must be from {} to {}!'.format(engine.MIN_SIZE,
+                                                         engine.MAX_SIZE))
+        if not engine.K <= request.k <= request.size:
+            raise endpoints.BadRequestException(
+                    'k must be from {} to the size!'.format(engine.K))
+        user = yield User.get_by_name_async(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
 
-        game = Game.new_game(user.key, 'Good luck playing Tic Tac Toe!')        
-
-        # Use a task queue to update the average attempts remaining.
+        # Use a task queue to update the average win rates.
         # This operation is not needed to complete the creation of a new game
-        # so it is performed out of sequence.
-        taskqueue.add(url='/tasks/cache_average_win_rates')
-        return game.to_form()
+        # so it is performed out of sequence, alongside the put, and
+        # coalesced so that a burst of new games queues a single recompute.
+        game, _ = yield (Game.new_game_async(
+                             user.key, 'Good luck playing Tic Tac Toe!',
+                             request.difficulty.name, request.write_behind,
+                             request.size, request.k),
+                         schedule_coalesced_task_async(
+                             AVERAGE_WIN_RATES_URL,
+                             AVERAGE_WIN_RATES_WINDOW))
+        raise ndb.Return(game.to_form(user.name))
 
 
 
@@ -126,12 +225,21 @@ class TicTacToeApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @latency.timed
+    @rpcstats.accounted
     def get_game(self, request):
         """Return the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        return self._get_game_async(request).get_result()
+
+    @ndb.tasklet
+    def _get_game_async(self, request):
+        game = yield get_by_urlsafe_async(request.urlsafe_game_key, Game,
+                                          entity_cache)
         if game:
             # game.message='Time to make a move!'
-            return game.to_form()
+            live, user = yield (hotstore.load_async(game),
+                                game.user.get_async())
+            raise ndb.Return(live.to_form(user.name))
         else:
             raise endpoints.NotFoundException('Game not found!')
 
@@ -143,13 +251,23 @@ class TicTacToeApi(remote.Service):
                       path='game/history/{urlsafe_game_key}',
                       name='get_game_history',
                       http_method='GET')
+    @latency.timed
+    @rpcstats.accounted
     def get_game_history(self, request):
         """Return the game history."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        return self._get_game_history_async(request).get_result()
+
+    @ndb.tasklet
+    def _get_game_history_async(self, request):
+        game = yield get_by_urlsafe_async(request.urlsafe_game_key, Game,
+                                          entity_cache)
         if game:
-            histories = History.query(History.game==game.key).order(History.datetime)
-            # histories = History.query(History.game==game.key)            
-            return HistoryForms(items = [history.to_form() for history in histories])
+            live = yield hotstore.load_async(game)
+            try:
+                raise ndb.Return(live.history_forms(page_size(request),
+                                                    request.page_token))
+            except ValueError:
+                raise endpoints.BadRequestException('Invalid page token')
         else:
             raise endpoints.NotFoundException('Game not found!')
 
@@ -165,13 +283,19 @@ class TicTacToeApi(remote.Service):
                       path='game/cancel/{urlsafe_game_key}',
                       name='cancel_game',
                       http_method='DELETE')
+    @latency.timed
+    @rpcstats.accounted
     def cancel_game(self, request):
         """Return the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        return self._cancel_game_async(request).get_result()
+
+    @ndb.tasklet
+    def _cancel_game_async(self, request):
+        game = yield get_by_urlsafe_async(request.urlsafe_game_key, Game)
         if game and game.game_over==False:
             # game.message='Time to make a move!'
-            game.key.delete()
-            return CancelGameForm(message="cancelled")
+            yield game.key.delete_async(), hotstore.discard_async(game.key)
+            raise ndb.Return(CancelGameForm(message="cancelled"))
         elif game and game.game_over:
             raise endpoints.ForbiddenException('Illegal action: Game is already over.')
         else:
@@ -189,77 +313,156 @@ class TicTacToeApi(remote.Service):
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @latency.timed
+    @rpcstats.accounted
     def make_move(self, request):
         """Makes a move. Returns a game state with message"""
-        if (request.pos < 0 or request.pos > 8):
-            raise endpoints.BadRequestException("only move from 0-8!")
+        return self._make_move_async(request).get_result()
+
+    @ndb.tasklet
+    def _make_move_async(self, request):
+        if request.pos < 0:
+            raise endpoints.BadRequestException("pos can not be negative!")
 
 
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
+        game = yield get_by_urlsafe_async(request.urlsafe_game_key, Game)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
+        if request.pos >= game.size * game.size:
+            raise endpoints.BadRequestException(
+                    "only move from 0-{}!".format(game.size * game.size - 1))
+        # the user's name for the form is read while the move commits
+        user_future = game.user.get_async()
+        if game.write_behind:
+            try:
+                game = yield self._make_move_write_behind_async(
+                    game, request.pos)
+            except hotstore.ContentionError:
+                raise endpoints.ConflictException(
+                        'Too many concurrent moves, try again.')
+        else:
+            game = yield ndb.transaction_async(
+                lambda: self._make_move_txn(request), xg=True)
+        user = yield user_future
+        raise ndb.Return(game.to_form(user.name))
+
+
+    @ndb.tasklet
+    def _make_move_txn(self, request):
+        """Applies the player's move and the robot's reply. Must run in a
+        cross-group transaction: every changed entity is collected and
+        committed by a single put_multi_async, so the game, its score and
+        the user's totals are written together or not at all."""
+        game = yield get_by_urlsafe_async(request.urlsafe_game_key, Game)
+        if not game:
+            raise endpoints.NotFoundException('Game not found!')
         if game.game_over:
             game.message = 'Game already over!'
-            return game.to_form()
-        
-        if (game.board[request.pos] != "-"):
+            raise ndb.Return(game)
+        result = self._play(game, request.pos)
+        if result:
+            entities = yield game.end_game_async(*result)
+            yield ndb.put_multi_async(entities)
+        else:
+            yield game.put_async()
+        raise ndb.Return(game)
+
+
+    @ndb.tasklet
+    def _make_move_write_behind_async(self, game, pos):
+        """Applies a move to a write_behind game. The move is buffered in
+        memcache; the game is only written, together with everything
+        end_game changes, when it ends or a checkpoint is due."""
+        for _ in range(hotstore.CAS_RETRIES):
+            live, state = yield hotstore.begin_async(game)
+            if live.game_over:
+                live.message = 'Game already over!'
+                raise ndb.Return(live)
+            result = self._play(live, pos)
+            if not result and not hotstore.checkpoint_due(live, state):
+                buffered = yield hotstore.buffer_async(live, state)
+                if buffered:
+                    raise ndb.Return(live)
+                continue
+            # claim the buffer first so no other request can add a move
+            # between the write and the checkpoint
+            buffered = yield hotstore.buffer_async(live, state)
+            if not buffered:
+                continue
+            written = False
+            try:
+                yield ndb.transaction_async(
+                    lambda: self._checkpoint_async(live, result), xg=True)
+                written = True
+            finally:
+                if not written:
+                    yield hotstore.revert_async(live, state)
+            yield hotstore.checkpointed_async(live)
+            raise ndb.Return(live)
+        raise hotstore.ContentionError(live.key.urlsafe())
+
+
+    @ndb.tasklet
+    def _checkpoint_async(self, live, result):
+        """Writes a live write_behind game, ending it if result is set. Must
+        run in a cross-group transaction."""
+        current = yield live.key.get_async()
+        if current is None or not hotstore.is_newer(live, current):
+            raise endpoints.ConflictException(
+                    'Game changed, try again.')
+        if result:
+            entities = yield live.end_game_async(*result)
+            yield ndb.put_multi_async(entities)
+        else:
+            yield live.put_async()
+
+
+    def _play(self, game, pos):
+        """Applies the player's move at pos and the robot's reply to game.
+        Returns the (winner, message) to end the game with, or None if the
+        game goes on."""
+        size, k = game.size, game.k
+        x, o = engine.unpack(game.board, size)
+        if not engine.is_free(x, o, pos):
             raise endpoints.BadRequestException("can not move here!")    
 
 
-        game.board = game.board[:request.pos] + "X" + game.board[request.pos+1:]
-        winner = self.get_winner(game.board, "X")
+        x = engine.place(x, pos)
+        winner = "X" if engine.wins_at(x, pos, size, k) else None
         player_message = "keep moving."
         if winner != None:
             player_message = "You win!"
-        elif game.board.count("-") < 1:
+        elif engine.is_full(x, o, size):
             player_message = "Tie!"
-        History(game=game.key, move=request.pos, result=player_message, datetime=datetime.now(), player="X").put()
-        if winner != None or game.board.count("-") < 1:
-            game.end_game(winner, player_message)
-            return game.to_form()
+        game.board = engine.pack(x, o, size)
+        game.add_move(pos, "X", player_message)
+        if winner != None or engine.is_full(x, o, size):
+            return winner, player_message
         
 
-        spaces = []
-        i = -1
-        for state in game.board:
-            i += 1
-            if (state == "-"):
-                spaces.append(i);
-        if (len(spaces) > 0):          
-            robot_move = random.choice(spaces)      
-            game.board = game.board[:robot_move] + "O" + game.board[robot_move+1:]
-            winner = self.get_winner(game.board, "O")
-            robot_message = "keep moving."  
-            if winner != None:
-                robot_message = "You lose!"
-            History(game=game.key, move=robot_move, result=robot_message, datetime=datetime.now(), player="O").put()
-            if winner != None:
-                game.end_game(winner, robot_message)
-                return game.to_form()
+        robot_move = robot.choose_move(game.difficulty, x, o, "O",
+                                       size=size, k=k)
+        o = engine.place(o, robot_move)
+        winner = "O" if engine.wins_at(o, robot_move, size, k) else None
+        robot_message = "keep moving."  
+        if winner != None:
+            robot_message = "You lose!"
+        elif engine.is_full(x, o, size):
+            # on even sized boards the robot takes the last cell
+            robot_message = "Tie!"
+        game.board = engine.pack(x, o, size)
+        game.add_move(robot_move, "O", robot_message)
+        if winner != None or engine.is_full(x, o, size):
+            return winner, robot_message
         
 
         game.message = "Keep moving."
-        game.put()                  
-        return game.to_form()        
-
 
 
-    def get_winner(self, board, chessman): 
-        if (board[0] == chessman and board[1] == chessman and board[2] == chessman):
-            return chessman
-        if (board[3] == chessman and board[4] == chessman and board[5] == chessman):
-            return chessman
-        if (board[6] == chessman and board[7] == chessman and board[8] == chessman):
-            return chessman
-        
-        if (board[0] == chessman and board[3] == chessman and board[6] == chessman):
-            return chessman
-        if (board[1] == chessman and board[4] == chessman and board[7] == chessman):
-            return chessman
-        if (board[2] == chessman and board[5] == chessman and board[8] == chessman):
-            return chessman
 
-        if (board[2] == chessman and board[4] == chessman and board[6] == chessman):
-            return chessman
-        if (board[0] == chessman and board[4] == chessman and board[8] == chessman):
+    def get_winner(self, board, chessman, size=engine.SIZE, k=engine.K):
+        """Returns chessman if it holds k in a row on board"""
+        if engine.has_line(engine.mask_of(board, chessman), size, k):
             return chessman
 
 
@@ -272,15 +475,25 @@ class TicTacToeApi(remote.Service):
                       path='games/user/{user_name}',
                       name='get_user_games',
                       http_method='GET')
+    @latency.timed
+    @rpcstats.accounted
     def get_user_games(self, request):
-        """Return all of individual active games."""
-        user = User.query(User.name == request.user_name).get()
+        """Return a page of individual active games."""
+        return self._get_user_games_async(request).get_result()
+
+    @ndb.tasklet
+    def _get_user_games_async(self, request):
+        user = yield User.get_by_name_async(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
         
-        games = Game.query(Game.user == user.key).filter(Game.game_over == False)
-        return GameForms(items=[game.to_form() for game in games])
+        games, next_page_token = yield fetch_page_async(
+            Game.query(Game.user == user.key).filter(Game.game_over == False),
+            request)
+        games = yield hotstore.load_multi_async(games)
+        forms = yield Game.to_forms_async(games, next_page_token)
+        raise ndb.Return(forms)
 
 
 
@@ -291,13 +504,23 @@ class TicTacToeApi(remote.Service):
 
 # GET SCORES ---------------------
 
-    @endpoints.method(response_message=ScoreForms,
+    @endpoints.method(request_message=PAGE_REQUEST,
+                      response_message=ScoreForms,
                       path='scores',
                       name='get_scores',
                       http_method='GET')
+    @latency.timed
+    @rpcstats.accounted
     def get_scores(self, request):
-        """Return all scores"""
-        return ScoreForms(items=[score.to_form() for score in Score.query()])
+        """Return a page of scores"""
+        return self._get_scores_async(request).get_result()
+
+    @ndb.tasklet
+    def _get_scores_async(self, request):
+        scores, next_page_token = yield fetch_page_async(Score.query(),
+                                                         request)
+        forms = yield Score.to_forms_async(scores, next_page_token)
+        raise ndb.Return(forms)
 
 
 # GET USER SOCRES -------------------------------
@@ -307,14 +530,22 @@ class TicTacToeApi(remote.Service):
                       path='scores/user/{user_name}',
                       name='get_user_scores',
                       http_method='GET')
+    @latency.timed
+    @rpcstats.accounted
     def get_user_scores(self, request):
-        """Returns all of an individual User's scores"""
-        user = User.query(User.name == request.user_name).get()
+        """Returns a page of an individual User's scores"""
+        return self._get_user_scores_async(request).get_result()
+
+    @ndb.tasklet
+    def _get_user_scores_async(self, request):
+        user = yield User.get_by_name_async(request.user_name)
         if not user:
             raise endpoints.NotFoundException(
                     'A User with that name does not exist!')
-        scores = Score.query(Score.user == user.key)
-        return ScoreForms(items=[score.to_form() for score in scores])
+        scores, next_page_token = yield fetch_page_async(
+            Score.query(Score.user == user.key), request)
+        forms = yield Score.to_forms_async(scores, next_page_token)
+        raise ndb.Return(forms)
 
 
 
@@ -325,9 +556,20 @@ class TicTacToeApi(remote.Service):
                       path='scores/high',
                       name='get_high_scores',
                       http_method='GET')
+    @latency.timed
+    @rpcstats.accounted
     def get_high_scores(self, request):
-        """Return all scores"""
-        return ScoreForms(items=[score.to_form() for score in Score.query().order(-Score.point).fetch(request.number_of_results)])
+        """Return the best scores, at most MAX_PAGE_SIZE of them"""
+        return self._get_high_scores_async(request).get_result()
+
+    @ndb.tasklet
+    def _get_high_scores_async(self, request):
+        number_of_results = page_size(request, MAX_PAGE_SIZE,
+                                      'number_of_results')
+        scores = yield Score.query().order(-Score.point).fetch_async(
+            number_of_results)
+        forms = yield Score.to_forms_async(scores)
+        raise ndb.Return(forms)
 
 
 
@@ -337,25 +579,42 @@ class TicTacToeApi(remote.Service):
                       path='games/average_win_rates',
                       name='get_average_win_rates',
                       http_method='GET')
+    @latency.timed
+    @rpcstats.accounted
     def get_average_win_rates(self, request):
         """Get the cached average win rate"""
-        return StringMessage(message=memcache.get(MEMCACHE_WIN_RATES) or '')
+        return self._get_average_win_rates_async().get_result()
+
+    @ndb.tasklet
+    def _get_average_win_rates_async(self):
+        message = yield ndb.get_context().memcache_get(MEMCACHE_WIN_RATES)
+        if not message:
+            message = yield self._cache_average_win_rates_async()
+        raise ndb.Return(StringMessage(message=message))
 
 
 # CACHE AVERAGE WIN RATES ----------------------------
 
     @staticmethod
     def _cache_average_win_rates():
-        """Populates memcache with the average win rates of Games"""
-        # games_win = len(Game.query(Game.winner == "X").fetch())
-        # games_over = len(Game.query(Game.game_over == True).fetch())
-        games_win = Game.query(Game.winner == "X").count()        
-        games_over = Game.query(Game.game_over == True).count()
+        """Populates memcache with the average win rates of Games and returns
+        the message. Reads the sharded game counters, so the cost does not
+        grow with the number of games played."""
+        return TicTacToeApi._cache_average_win_rates_async().get_result()
+
+    @staticmethod
+    @ndb.tasklet
+    def _cache_average_win_rates_async():
+        games_win, games_over = yield (
+            counters.get_count_async(counters.GAMES_WON_BY_X),
+            counters.get_count_async(counters.GAMES_OVER))
 
         if games_over > 0:
             average = float(games_win)/games_over
-            memcache.set(MEMCACHE_WIN_RATES,
-                         'The average win rate is {:.2f}'.format(average))
+            message = 'The average win rate is {:.2f}'.format(average)
+            yield ndb.get_context().memcache_set(MEMCACHE_WIN_RATES, message)
+            raise ndb.Return(message)
+        raise ndb.Return('')
 
 
 api = endpoints.api_server([TicTacToeApi])
@@ -0,0 +1,147 @@
+"""batch.py - Vectorized evaluation of many boards at once with NumPy.
+
+For analytics and mass re-evaluation, such as recomputing the outcome of
+every stored game, where get_winner one board at a time is far too slow.
+Boards are an (N, 9) int8 array, cell i of row n being EMPTY, X or O. Each
+side's cells are reduced to the same 9-bit masks engine uses by one matrix
+product with the cell weights, and every operation after that is a
+whole-array one: winners tests the masks against the eight line masks, and
+best_moves and values look the canonical keys up in the solver book with a
+binary search.
+
+from_packed, from_strings, from_move_logs and from_history decode boards
+from Game.board, GameForm.board, Game.moves and History exports. NumPy is
+only needed here; the application does not import this module."""
+
+import numpy as np
+
+import engine
+import solver
+
+
+EMPTY, X, O = 0, 1, 2
+# the value of a board no game can reach
+UNREACHABLE = -2
+
+CELLS = np.arange(engine.CELLS)
+# WEIGHTS[i] is the bit of cell i in a mask
+WEIGHTS = (1 << CELLS).astype(np.int32)
+LINES = np.array(engine.LINES, dtype=np.int32)
+TRANSFORMS = np.array(engine.TRANSFORMS, dtype=np.int32)
+INVERSES = np.array(engine.INVERSES, dtype=np.int8)
+
+# the records of a book, see solver.RECORD
+BOOK_DTYPE = np.dtype([('key', '<u4'), ('move', 'i1'), ('value', 'i1'),
+                       ('depth', 'u1')])
+_records = []
+
+
+def masks(boards):
+    """Returns the (x, o) masks of an (N, 9) array of boards"""
+    boards = np.asarray(boards)
+    return (np.dot(boards == X, WEIGHTS).astype(np.int32),
+            np.dot(boards == O, WEIGHTS).astype(np.int32))
+
+
+def _has_line(mask):
+    return ((mask[:, None] & LINES) == LINES).any(axis=1)
+
+
+def winners(boards):
+    """Returns an (N,) int8 array of X or O for the side holding a line of
+    each board, EMPTY if neither does"""
+    x, o = masks(boards)
+    result = np.zeros(len(x), dtype=np.int8)
+    result[_has_line(o)] = O
+    result[_has_line(x)] = X
+    return result
+
+
+def free_masks(boards):
+    """Returns an (N,) int32 array of the masks of the free cells"""
+    return np.dot(np.asarray(boards) == EMPTY, WEIGHTS).astype(np.int32)
+
+
+def canonical(x, o):
+    """Returns the (keys, transforms) of engine.canonical for arrays of
+    masks"""
+    keys = TRANSFORMS[:, x] | TRANSFORMS[:, o] << engine.CELLS
+    transforms = keys.argmin(axis=0)
+    return keys[transforms, np.arange(len(x))], transforms
+
+
+def book_records():
+    """Returns the records of the solver book as a structured array, sorted
+    by key"""
+    if not _records:
+        book = solver.get_book()
+        _records.append(np.frombuffer(book.data, dtype=BOOK_DTYPE,
+                                      count=len(book.keys),
+                                      offset=solver.HEADER.size))
+    return _records[0]
+
+
+def _lookup(boards):
+    """Returns the book records of boards, the transforms to their
+    canonical boards and which of them are reachable"""
+    records = book_records()
+    keys, transforms = canonical(*masks(boards))
+    index = np.searchsorted(records['key'], keys)
+    index[index == len(records)] = 0
+    found = records['key'][index] == keys
+    return records[index], transforms, found
+
+
+def best_moves(boards):
+    """Returns an (N,) int8 array of the perfect move for the side to move
+    on each board, -1 where the game is over or cannot be reached"""
+    records, transforms, found = _lookup(boards)
+    moves = np.where(found, records['move'], -1).astype(np.int8)
+    playable = moves >= 0
+    moves[playable] = INVERSES[transforms[playable], moves[playable]]
+    return moves
+
+
+def values(boards):
+    """Returns an (N,) int8 array of 1, 0 or -1 for the side to move on
+    each board, UNREACHABLE where it cannot be reached"""
+    records, _, found = _lookup(boards)
+    return np.where(found, records['value'],
+                    UNREACHABLE).astype(np.int8)
+
+
+def from_packed(boards):
+    """Returns the (N, 9) boards of an array of packed Game.board values"""
+    boards = np.asarray(boards, dtype=np.int64)[:, None]
+    return ((boards >> CELLS & 1) * X +
+            (boards >> (CELLS + engine.CELLS) & 1) * O).astype(np.int8)
+
+
+def from_strings(boards):
+    """Returns the (N, 9) boards of a list of board strings"""
+    cells = np.frombuffer(''.join(boards).encode('ascii'),
+                          dtype=np.uint8).reshape(-1, engine.CELLS)
+    return ((cells == ord('X')) * X + (cells == ord('O')) * O).astype(
+        np.int8)
+
+
+def from_move_logs(logs):
+    """Returns the (N, 9) final boards of a list of Game.moves logs of
+    standard boards, one byte per move"""
+    lengths = [len(log) for log in logs]
+    records = np.frombuffer(b''.join(logs), dtype=np.uint8)
+    games = np.repeat(np.arange(len(logs)), lengths)
+    boards = np.zeros((len(logs), engine.CELLS), dtype=np.int8)
+    boards[games, records & 0xf] = (records >> 4 & 1) + X
+    return boards
+
+
+def from_history(games, moves, players):
+    """Returns (game ids, (G, 9) final boards) of a History export given
+    as parallel sequences of the game id, move and player ("X" or "O") of
+    every row"""
+    ids, index = np.unique(np.asarray(games), return_inverse=True)
+    boards = np.zeros((len(ids), engine.CELLS), dtype=np.int8)
+    boards[index, np.asarray(moves)] = np.where(
+        np.asarray(players) == "O", O, X)
+    return ids, boards
@@ -0,0 +1,91 @@
+"""counters.py - Sharded counters for totals that would otherwise need a
+count() query over every entity ever written.
+
+Each named counter is split over NUM_SHARDS entities so concurrent increments
+rarely touch the same entity group. Reading a counter sums the shards with one
+batched get, and the total is cached in memcache.
+
+Counters started at zero when they were introduced. backfill seeds an extra
+shard, which increments never pick, with what the regular shards miss of a
+total counted from the games themselves."""
+
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+
+NUM_SHARDS = 20
+CACHE_SECONDS = 60
+
+GAMES_OVER = 'games_over'
+GAMES_WON_BY_X = 'games_won_by_x'
+
+
+class CounterShard(ndb.Model):
+    """One shard of a named counter"""
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+
+def _shard_keys(name):
+    return [ndb.Key(CounterShard, '{}-{}'.format(name, index))
+            for index in range(NUM_SHARDS)]
+
+
+def _backfill_key(name):
+    return ndb.Key(CounterShard, '{}-backfill'.format(name))
+
+
+def _cache_key(name):
+    return 'COUNTER-' + name
+
+
+def increment(name, delta=1):
+    """Returns a random shard of the counter with delta added. Does not
+    write: call inside a transaction that puts the returned shard, and the
+    cached total is bumped once that transaction commits."""
+    return increment_async(name, delta).get_result()
+
+
+@ndb.tasklet
+def increment_async(name, delta=1):
+    """Tasklet version of increment"""
+    key = random.choice(_shard_keys(name))
+    shard = (yield key.get_async()) or CounterShard(key=key)
+    shard.count += delta
+    ndb.get_context().call_on_commit(
+        lambda: memcache.incr(_cache_key(name), delta))
+    raise ndb.Return(shard)
+
+
+def get_count(name):
+    """Returns the total of the counter"""
+    return get_count_async(name).get_result()
+
+
+@ndb.tasklet
+def get_count_async(name):
+    """Tasklet version of get_count"""
+    context = ndb.get_context()
+    total = yield context.memcache_get(_cache_key(name))
+    if total is None:
+        # the total is cached for CACHE_SECONDS anyway, and an eventually
+        # consistent get is not split into one RPC per 10 entity groups
+        shards = yield ndb.get_multi_async(
+            _shard_keys(name) + [_backfill_key(name)],
+            read_policy=ndb.EVENTUAL_CONSISTENCY)
+        total = sum(shard.count for shard in shards if shard)
+        yield context.memcache_add(_cache_key(name), total,
+                                   time=CACHE_SECONDS)
+    raise ndb.Return(total)
+
+
+def backfill(name, total):
+    """Sets the backfill shard of the counter so that the counter adds up to
+    total. Running it again recomputes the shard, so it is safe to retry;
+    increments made between counting total and the put are lost, so run it
+    while few games end."""
+    shards = ndb.get_multi(_shard_keys(name))
+    counted = sum(shard.count for shard in shards if shard)
+    CounterShard(key=_backfill_key(name), count=total - counted).put()
+    memcache.delete(_cache_key(name))
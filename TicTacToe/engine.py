@@ -0,0 +1,182 @@
+"""engine.py - Bitboard representation of the Tic Tac Toe board.
+
+Each side is stored as a 9-bit integer mask where bit i is set when that side
+holds cell i (cells are numbered 0-8, left to right, top to bottom). Win
+detection, free-cell enumeration and the full-board check are all table
+lookups or single bit operations on those masks. Stored boards pack both
+masks into one integer, x in bits 0-8 and o in bits 9-17.
+
+Larger variants, SIZE x SIZE boards won with K in a row, use the same masks
+with SIZE * SIZE bits per side. Too many lines run through such a board to
+tabulate, so wins_at only walks the four directions through the cell just
+played: O(K) per move instead of a scan of every line.
+
+The eight rotations and reflections of the standard board map a position
+to positions with the same value, so canonical() keys them all by one
+packed board; anything keyed by position only has to hold one entry per
+eight."""
+
+
+SIZE = 3
+K = 3
+MIN_SIZE = 3
+MAX_SIZE = 19
+CELLS = SIZE * SIZE
+FULL = (1 << CELLS) - 1
+EMPTY = "-"
+
+# (row, column) steps of a row, a column and the two diagonals
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+# rows, columns, then the two diagonals
+LINES = (0x007, 0x038, 0x1c0,
+         0x049, 0x092, 0x124,
+         0x054, 0x111)
+
+# WINS[mask] is True when mask contains at least one complete line
+WINS = tuple(any(mask & line == line for line in LINES)
+             for mask in range(1 << CELLS))
+
+# FREE_CELLS[occupied] lists the cells not set in the occupied mask
+FREE_CELLS = tuple(tuple(i for i in range(CELLS) if not occupied & (1 << i))
+                   for occupied in range(1 << CELLS))
+
+
+
+def _rotate(pos):
+    row, col = divmod(pos, SIZE)
+    return col * SIZE + SIZE - 1 - row
+
+
+def _reflect(pos):
+    row, col = divmod(pos, SIZE)
+    return row * SIZE + SIZE - 1 - col
+
+
+def _symmetries():
+    cells = tuple(range(CELLS))
+    result = []
+    for reflected in (cells, tuple(_reflect(i) for i in cells)):
+        for _ in range(4):
+            result.append(reflected)
+            reflected = tuple(_rotate(i) for i in reflected)
+    return tuple(result)
+
+
+# SYMMETRIES[t][i] is the cell that cell i goes to under transform t, the
+# identity first; INVERSES[t] takes it back
+SYMMETRIES = _symmetries()
+INVERSES = tuple(tuple(cells.index(i) for i in range(CELLS))
+                 for cells in SYMMETRIES)
+
+# TRANSFORMS[t][mask] is mask under transform t
+TRANSFORMS = tuple(tuple(sum(1 << cells[i] for i in range(CELLS)
+                             if mask & (1 << i))
+                         for mask in range(1 << CELLS))
+                   for cells in SYMMETRIES)
+
+def from_string(board):
+    """Returns the (x, o) masks of a 9 character board string"""
+    x = o = 0
+    for i, state in enumerate(board):
+        if state == "X":
+            x |= 1 << i
+        elif state == "O":
+            o |= 1 << i
+    return x, o
+
+
+def to_string(x, o, size=SIZE):
+    """Returns the board string of the (x, o) masks"""
+    return "".join("X" if x & (1 << i) else "O" if o & (1 << i) else EMPTY
+                   for i in range(size * size))
+
+
+def pack(x, o, size=SIZE):
+    """Returns the (x, o) masks packed into one integer"""
+    return x | o << size * size
+
+
+def unpack(board, size=SIZE):
+    """Returns the (x, o) masks of a packed board"""
+    cells = size * size
+    return board & (1 << cells) - 1, board >> cells
+
+
+def canonical(x, o):
+    """Returns (key, t): key is the least packed board among the eight
+    symmetric images of the (x, o) masks and t the transform giving it"""
+    best = best_t = None
+    for t, table in enumerate(TRANSFORMS):
+        key = table[x] | table[o] << CELLS
+        if best is None or key < best:
+            best, best_t = key, t
+    return best, best_t
+
+
+def from_canonical(pos, t):
+    """Returns the cell of the original board that is cell pos of the
+    canonical board reached by transform t"""
+    return INVERSES[t][pos]
+
+
+def mask_of(board, chessman):
+    """Returns the mask of the cells held by chessman on a board string"""
+    x, o = from_string(board)
+    return x if chessman == "X" else o
+
+
+def place(mask, pos):
+    """Returns mask with cell pos set"""
+    return mask | (1 << pos)
+
+
+def is_free(x, o, pos):
+    """True if cell pos is held by neither side"""
+    return not (x | o) & (1 << pos)
+
+
+def is_win(mask):
+    """True if mask holds a complete line"""
+    return WINS[mask]
+
+
+def wins_at(mask, pos, size=SIZE, k=K):
+    """True if mask holds k in a row through pos. On the standard board
+    this is a table lookup of any line, which is the same thing as long
+    as pos is the cell just played and mask held no line before it."""
+    if size == SIZE and k == K:
+        return WINS[mask]
+    row, col = divmod(pos, size)
+    for dr, dc in DIRECTIONS:
+        count = 1
+        for step in (1, -1):
+            r, c = row + dr * step, col + dc * step
+            while count < k and 0 <= r < size and 0 <= c < size and \
+                    mask >> (r * size + c) & 1:
+                count += 1
+                r, c = r + dr * step, c + dc * step
+        if count >= k:
+            return True
+    return False
+
+
+def has_line(mask, size=SIZE, k=K):
+    """True if mask holds k in a row anywhere on the board"""
+    if size == SIZE and k == K:
+        return WINS[mask]
+    return any(wins_at(mask, pos, size, k)
+               for pos in range(size * size) if mask >> pos & 1)
+
+
+def is_full(x, o, size=SIZE):
+    """True if every cell is taken"""
+    return x | o == (1 << size * size) - 1
+
+
+def free_cells(x, o, size=SIZE):
+    """Returns a tuple of the free cells"""
+    if size == SIZE:
+        return FREE_CELLS[x | o]
+    occupied = x | o
+    return tuple(i for i in range(size * size) if not occupied >> i & 1)
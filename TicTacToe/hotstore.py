@@ -0,0 +1,312 @@
+"""hotstore.py - Write-behind store for in-progress write_behind games.
+
+The Game entity is a checkpoint. Moves made since the checkpoint are kept in
+memcache under the game's key, next to the number of moves the checkpoint
+holds and the latest message, and are updated with compare-and-set. A live
+game is rebuilt by replaying the buffered moves onto its checkpoint, so the
+entity only has to be written when the game ends, when CHECKPOINT_MOVES moves
+have been buffered, or when the periodic checkpoint task flushes it.
+
+Buffered moves are lost if memcache evicts them before a checkpoint; the game
+then resumes from its last checkpoint.
+
+Games with buffered moves are marked in one of DIRTY_SHARDS sets picked by
+a hash of the game's key, so concurrent moves of different games rarely
+compare-and-set the same memcache value. The checkpoint cron job fans out a
+task per shard that has entries, and each task checkpoints at most
+FLUSH_BATCH_SIZE games before chaining the next batch of its shard."""
+
+import logging
+import zlib
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import engine
+from models import Game, unpack_moves
+
+
+CHECKPOINT_MOVES = 10
+CAS_RETRIES = 10
+PREFIX = 'HOT-'
+# sets of the urlsafe keys of the games with buffered moves
+MEMCACHE_DIRTY = 'HOT-DIRTY-'
+DIRTY_SHARDS = 32
+# keeps a pickled set well below the 1MB memcache value limit
+DIRTY_LIMIT = 5000
+FLUSH_BATCH_SIZE = 100
+
+
+class ContentionError(Exception):
+    """Raised when the buffer of a game keeps changing under a request"""
+    pass
+
+
+def _name(key):
+    return PREFIX + key.urlsafe()
+
+
+def _empty(game):
+    return {'checkpoint': len(game.moves), 'moves': '',
+            'message': game.message}
+
+
+def apply(game, state):
+    """Returns a copy of the checkpoint game with the buffered moves of
+    state replayed onto it. A state left over from an older checkpoint is
+    ignored."""
+    live = Game(key=game.key, **game.to_dict())
+    if not state or state['checkpoint'] != len(game.moves):
+        return live
+    x, o = engine.unpack(live.board, live.size)
+    for pos, player, _ in unpack_moves(state['moves'], live.move_width):
+        if player == "X":
+            x = engine.place(x, pos)
+        else:
+            o = engine.place(o, pos)
+    live.board = engine.pack(x, o, live.size)
+    live.moves += state['moves']
+    live.message = state['message']
+    return live
+
+
+def load(game):
+    """Returns the live game of a write_behind game"""
+    return load_async(game).get_result()
+
+
+@ndb.tasklet
+def load_async(game):
+    """Tasklet version of load"""
+    if not game.write_behind or game.game_over:
+        raise ndb.Return(game)
+    state = yield ndb.get_context().memcache_get(_name(game.key))
+    raise ndb.Return(apply(game, state))
+
+
+def load_multi(games):
+    """Returns the live games of games, with one memcache round trip"""
+    return load_multi_async(games).get_result()
+
+
+@ndb.tasklet
+def load_multi_async(games):
+    """Tasklet version of load_multi. The lookups of the games are batched
+    into one memcache call."""
+    live = yield [load_async(game) for game in games]
+    raise ndb.Return(live)
+
+
+@ndb.tasklet
+def begin_async(game):
+    """Returns the live game and the buffer state it was built from, read
+    with memcache_gets so that buffer_async can compare-and-set against
+    it"""
+    context = ndb.get_context()
+    for _ in range(CAS_RETRIES):
+        state = yield context.memcache_gets(_name(game.key))
+        if state is not None and state['checkpoint'] > len(game.moves):
+            # another request checkpointed since game was read
+            game = yield game.key.get_async(use_cache=False,
+                                            use_memcache=False)
+            continue
+        if state is None or state['checkpoint'] < len(game.moves):
+            # no buffer yet, or one the checkpoint has overtaken
+            if state is None:
+                yield context.memcache_add(_name(game.key), _empty(game))
+            else:
+                yield context.memcache_cas(_name(game.key), _empty(game))
+            continue
+        raise ndb.Return((apply(game, state), state))
+    raise ContentionError(_name(game.key))
+
+
+def checkpoint_due(live, state):
+    """True once CHECKPOINT_MOVES moves are buffered"""
+    return ((len(live.moves) - state['checkpoint']) // live.move_width >=
+            CHECKPOINT_MOVES)
+
+
+@ndb.tasklet
+def buffer_async(live, state):
+    """Compare-and-sets the moves live made since its checkpoint. Returns
+    False if another request changed the buffer first."""
+    stored = yield ndb.get_context().memcache_cas(
+        _name(live.key),
+        {'checkpoint': state['checkpoint'],
+         'moves': live.moves[state['checkpoint']:],
+         'message': live.message})
+    if not stored:
+        raise ndb.Return(False)
+    yield _mark_dirty_async(live.key)
+    raise ndb.Return(True)
+
+
+@ndb.tasklet
+def revert_async(live, state):
+    """Puts back the buffer state that live was built from, after a write
+    of live failed"""
+    context = ndb.get_context()
+    for _ in range(CAS_RETRIES):
+        current = yield context.memcache_gets(_name(live.key))
+        if (current is None or current['checkpoint'] != state['checkpoint'] or
+                current['moves'] != live.moves[state['checkpoint']:]):
+            return
+        stored = yield context.memcache_cas(_name(live.key), state)
+        if stored:
+            return
+
+
+def checkpointed(live):
+    """Rebases the buffer onto live once live has been written to the
+    datastore, keeping any moves buffered after it"""
+    checkpointed_async(live).get_result()
+
+
+@ndb.tasklet
+def checkpointed_async(live):
+    """Tasklet version of checkpointed"""
+    context = ndb.get_context()
+    for _ in range(CAS_RETRIES):
+        state = yield context.memcache_gets(_name(live.key))
+        if state is None or state['checkpoint'] >= len(live.moves):
+            return
+        written = len(live.moves) - state['checkpoint']
+        stored = yield context.memcache_cas(
+            _name(live.key),
+            {'checkpoint': len(live.moves),
+             'moves': state['moves'][written:],
+             'message': state['message']})
+        if stored:
+            return
+
+
+def is_newer(live, current):
+    """True if live holds every move of current, the entity as stored now,
+    so writing live cannot lose a move"""
+    return live.moves.startswith(current.moves)
+
+
+def discard(key):
+    """Drops the buffer of a deleted game"""
+    memcache.delete(_name(key))
+
+
+def discard_async(key):
+    """Returns a future that drops the buffer of a deleted game"""
+    return ndb.get_context().memcache_delete(_name(key))
+
+
+def dirty_shard(key):
+    """Returns the dirty set shard of a game key"""
+    return zlib.crc32(key.urlsafe()) % DIRTY_SHARDS
+
+
+def _mark_dirty(key):
+    """Adds key to its dirty set. Returns False, and logs why, if it could
+    not; the game is then only written when it ends or a checkpoint is
+    due."""
+    return _mark_dirty_async(key).get_result()
+
+
+@ndb.tasklet
+def _mark_dirty_async(key):
+    """Tasklet version of _mark_dirty"""
+    context = ndb.get_context()
+    name = MEMCACHE_DIRTY + str(dirty_shard(key))
+    for _ in range(CAS_RETRIES):
+        dirty = yield context.memcache_gets(name)
+        if dirty is None:
+            added = yield context.memcache_add(name, set([key.urlsafe()]))
+            if added:
+                raise ndb.Return(True)
+            continue
+        if key.urlsafe() in dirty:
+            raise ndb.Return(True)
+        if len(dirty) >= DIRTY_LIMIT:
+            logging.error('dirty set %s is full, not marking %s', name,
+                          key.urlsafe())
+            raise ndb.Return(False)
+        dirty.add(key.urlsafe())
+        stored = yield context.memcache_cas(name, dirty)
+        if stored:
+            raise ndb.Return(True)
+    logging.error('could not mark %s dirty in %s: too much contention',
+                  key.urlsafe(), name)
+    raise ndb.Return(False)
+
+
+def dirty_shards():
+    """Returns the shards whose dirty sets have entries"""
+    names = [MEMCACHE_DIRTY + str(shard) for shard in range(DIRTY_SHARDS)]
+    dirty = memcache.get_multi(names)
+    return [shard for shard, name in enumerate(names) if dirty.get(name)]
+
+
+def _clear_dirty(client, shard, taken):
+    """Removes the keys of checkpointed games from a dirty set"""
+    name = MEMCACHE_DIRTY + str(shard)
+    for _ in range(CAS_RETRIES):
+        dirty = client.gets(name)
+        if not dirty:
+            return
+        if client.cas(name, dirty.difference(taken)):
+            return
+    logging.warning('could not clear %d keys from dirty set %s: too much '
+                    'contention, they are checked again at the next '
+                    'checkpoint', len(taken), name)
+
+
+def flush_shard(shard, batch_size=FLUSH_BATCH_SIZE):
+    """Checkpoints up to batch_size games of one dirty set. Returns how many
+    games were written and whether the set has more.
+
+    Keys are only removed from the set once their games are written, so a
+    checkpoint that raises or a task that is cut off leaves them marked for
+    the retry."""
+    client = memcache.Client()
+    dirty = client.get(MEMCACHE_DIRTY + str(shard))
+    if not dirty:
+        return 0, False
+    taken = sorted(dirty)[:batch_size]
+    games = [game for game in
+             ndb.get_multi([ndb.Key(urlsafe=name) for name in taken])
+             if game and not game.game_over]
+    states = client.get_multi([_name(game.key) for game in games])
+    written = 0
+    for game in games:
+        live = apply(game, states.get(_name(game.key)))
+        if len(live.moves) > len(game.moves) and _checkpoint(live):
+            checkpointed(live)
+            written += 1
+    _clear_dirty(client, shard, taken)
+    # a move buffered while the batch was written found its key still in
+    # the set, so mark it again
+    states = client.get_multi([_name(game.key) for game in games])
+    for game in games:
+        state = states.get(_name(game.key))
+        if state and state['moves'] and \
+                state['checkpoint'] >= len(game.moves):
+            _mark_dirty(game.key)
+    return written, len(dirty) > len(taken)
+
+
+def flush_dirty():
+    """Checkpoints every game with buffered moves, shard by shard. Returns
+    how many games were written."""
+    written = 0
+    for shard in range(DIRTY_SHARDS):
+        more = True
+        while more:
+            count, more = flush_shard(shard)
+            written += count
+    return written
+
+
+@ndb.transactional
+def _checkpoint(live):
+    current = live.key.get()
+    if current is None or current.game_over or not is_newer(live, current):
+        return False
+    live.put()
+    return True
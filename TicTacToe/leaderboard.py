@@ -0,0 +1,111 @@
+"""leaderboard.py - Materialized ranking of the top users by win rate.
+
+The board is a sorted list of at most LEADERBOARD_SIZE entries kept in
+memcache and updated in place with compare-and-set whenever a game changes a
+user's totals, so top-N pages, rank lookups and windows around a user are
+slices and binary searches instead of a scan of the User kind. A datastore
+snapshot, refreshed by cron, restores the board when memcache loses it.
+
+A full board cannot tell which user off it comes next, so a user demoted
+below its last entry is dropped and a rebuild is queued at REBUILD_URL."""
+
+import bisect
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from utils import schedule_coalesced_task
+
+
+LEADERBOARD_SIZE = 1000
+MEMCACHE_LEADERBOARD = 'LEADERBOARD'
+REBUILD_URL = '/tasks/rebuild_leaderboard'
+CAS_RETRIES = 10
+
+
+class LeaderboardSnapshot(ndb.Model):
+    """Datastore copy of the board"""
+    entries = ndb.JsonProperty(compressed=True)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+def _snapshot_key():
+    return ndb.Key(LeaderboardSnapshot, 'users')
+
+
+def entry(user):
+    """Returns the board entry of a user. Entries sort best first: highest
+    rate, then most wins, then name."""
+    return (-user.rate, -user.wins, user.name, user.total)
+
+
+def fields(board_entry):
+    """Returns the UserForm fields of a board entry"""
+    rate, wins, name, total = board_entry
+    return dict(name=name, wins=-wins, total=total, rate=-rate)
+
+
+def _sorted(entries):
+    return sorted(tuple(e) for e in entries)[:LEADERBOARD_SIZE]
+
+
+def get_board():
+    """Returns the board, or None if it has never been built"""
+    return get_board_async().get_result()
+
+
+@ndb.tasklet
+def get_board_async():
+    """Tasklet version of get_board"""
+    context = ndb.get_context()
+    board = yield context.memcache_get(MEMCACHE_LEADERBOARD)
+    if board is None:
+        snapshot = yield _snapshot_key().get_async()
+        if snapshot is None:
+            raise ndb.Return(None)
+        board = _sorted(snapshot.entries)
+        yield context.memcache_add(MEMCACHE_LEADERBOARD, board)
+    raise ndb.Return(board)
+
+
+def rebuild(users):
+    """Replaces the board and its snapshot with the given top users and
+    returns the new board"""
+    board = _sorted(entry(user) for user in users)
+    memcache.set(MEMCACHE_LEADERBOARD, board)
+    LeaderboardSnapshot(key=_snapshot_key(), entries=board).put()
+    return board
+
+
+def update(old_entry, new_entry):
+    """Moves a user from old_entry to new_entry on the board. Does nothing
+    if the board is not in memcache; the next rebuild includes the user.
+    Only memcache is used, so that it can run from the on-commit callback
+    of the transaction that changed the user."""
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        board = client.gets(MEMCACHE_LEADERBOARD)
+        if board is None:
+            return
+        full = len(board) >= LEADERBOARD_SIZE
+        index = bisect.bisect_left(board, old_entry)
+        dropped = False
+        if index < len(board) and board[index] == old_entry:
+            del board[index]
+            # users off a full board may rank above the new entry
+            dropped = full and bool(board) and new_entry > board[-1]
+        if not dropped:
+            bisect.insort(board, new_entry)
+        if client.cas(MEMCACHE_LEADERBOARD, board[:LEADERBOARD_SIZE]):
+            if dropped:
+                schedule_coalesced_task(REBUILD_URL)
+            return
+
+
+def rank(board, user_entry):
+    """Returns the 1-based rank of an entry, or None if it is not on the
+    board"""
+    index = bisect.bisect_left(board, user_entry)
+    if index < len(board) and board[index] == user_entry:
+        return index + 1
+    return None
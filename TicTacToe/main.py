@@ -3,41 +3,237 @@
 """main.py - This file contains handlers that are called by taskqueue and/or
 cronjobs."""
 import logging
+import time
 
 import webapp2
-from google.appengine.api import mail, app_identity
-from api import TicTacToeApi
+from google.appengine.api import mail, app_identity, taskqueue
+from google.appengine.ext import ndb
+from api import TicTacToeApi, AVERAGE_WIN_RATES_URL
+from utils import clear_coalesced_task
+import solver
+import leaderboard
+import counters
+import hotstore
+import latency
+import rpcstats
 
-from models import User, Game
+from models import User, Game, History
+
+
+REMINDER_SHARD_URL = '/tasks/send_reminder_shard'
+# users mailed by one shard task, which bounds its mail calls and its get
+REMINDER_SHARD_SIZE = 100
+CHECKPOINT_SHARD_URL = '/tasks/checkpoint_shard'
+
+
+def _reminder_task_name(run, shard):
+    return 'reminder-{}-{}'.format(run, shard)
+
+
+def _add_reminder_shard(run, shard, cursor=None):
+    """Enqueues a reminder shard task. The name makes the chain idempotent,
+    so a retried shard does not start a second copy of the rest of it."""
+    params = {'run': run, 'shard': shard}
+    if cursor:
+        params['cursor'] = cursor
+    try:
+        taskqueue.add(url=REMINDER_SHARD_URL, params=params,
+                      name=_reminder_task_name(run, shard))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        logging.info('reminder shard %s of run %s already queued',
+                     shard, run)
 
 
 class SendReminderEmail(webapp2.RequestHandler):
     def get(self):
-        """Send a reminder email to each User with an email about games.
-        Called every hour using a cron job"""
+        """Start sending a reminder email to each User with an email about
+        unfinished games. Called every 12 hours using a cron job; the users
+        are mailed by a chain of shard tasks."""
+        _add_reminder_shard(int(time.time()), 0)
+
+
+class SendReminderShard(webapp2.RequestHandler):
+    def post(self):
+        """Mail one shard of the users with unfinished games and chain a
+        task for the next shard."""
+        run = self.request.get('run')
+        shard = int(self.request.get('shard'))
+        keys, cursor = Game.users_with_open_games(
+            self.request.get('cursor') or None, REMINDER_SHARD_SIZE)
+        if cursor:
+            # queue the next shard first so shards overlap
+            _add_reminder_shard(run, shard + 1, cursor)
         app_id = app_identity.get_application_id()
-        users = User.query(User.email != None)
-        for user in users:
-            games_not_over = Game.query(Game.user==user.key).filter(Game.game_over==False).count()
-            if games_not_over > 0:
+        sender = 'noreply@{}.appspotmail.com'.format(app_id)
+        sent = 0
+        for user in ndb.get_multi(keys):
+            if user and user.email:
                 subject = 'This is a reminder!'
                 body = 'Hello {}, try to finish Tic Tac Toe!'.format(user.name)
                 # This will send test emails, the arguments to send_mail are:
                 # from, to, subject, body
-                mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                           user.email,
-                           subject,
-                           body)
+                mail.send_mail(sender, user.email, subject, body)
+                sent += 1
+        logging.info('reminder run %s shard %d mailed %d users',
+                     run, shard, sent)
+        self.response.set_status(204)
 
 
 class UpdateAverageWinRates(webapp2.RequestHandler):
     def post(self):
         """Update game listing announcement in memcache."""
+        absorbed = clear_coalesced_task(AVERAGE_WIN_RATES_URL)
+        logging.info('average win rates recompute absorbed %d requests',
+                     absorbed)
         TicTacToeApi._cache_average_win_rates()
         self.response.set_status(204)
 
 
+class SnapshotLeaderboard(webapp2.RequestHandler):
+    def get(self):
+        """Rebuild the leaderboard from the User kind and save its datastore
+        snapshot. Called every 10 minutes using a cron job"""
+        leaderboard.rebuild(User.query().order(-User.rate).fetch(
+            leaderboard.LEADERBOARD_SIZE))
+
+
+class RebuildLeaderboard(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild the leaderboard after a user was dropped from the full
+        board, so that the users below it move up."""
+        clear_coalesced_task(leaderboard.REBUILD_URL)
+        leaderboard.rebuild(User.query().order(-User.rate).fetch(
+            leaderboard.LEADERBOARD_SIZE))
+        self.response.set_status(204)
+
+
+class CheckpointGames(webapp2.RequestHandler):
+    def get(self):
+        """Write the buffered moves of write_behind games to the datastore,
+        one task per dirty set shard that has entries. Called every minute
+        using a cron job"""
+        shards = hotstore.dirty_shards()
+        if shards:
+            taskqueue.Queue().add([
+                taskqueue.Task(url=CHECKPOINT_SHARD_URL,
+                               params={'shard': shard})
+                for shard in shards])
+
+
+class CheckpointShard(webapp2.RequestHandler):
+    def post(self):
+        """Checkpoint one batch of the games of a dirty set shard and chain
+        a task for the next batch."""
+        shard = int(self.request.get('shard'))
+        written, more = hotstore.flush_shard(shard)
+        logging.info('checkpointed %d games of shard %d', written, shard)
+        if more:
+            taskqueue.add(url=CHECKPOINT_SHARD_URL, params={'shard': shard})
+        self.response.set_status(204)
+
+
+class MigrateHistory(webapp2.RequestHandler):
+    def post(self):
+        """Fold the History rows of one batch of games into their move
+        logs and chain a task for the next batch."""
+        cursor = History.migrate_batch(self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(url='/tasks/migrate_history',
+                          params={'cursor': cursor})
+        self.response.set_status(204)
+
+
+class MigrateUserKeys(webapp2.RequestHandler):
+    def post(self):
+        """Re-key one batch of users by name and chain a task for the next
+        batch."""
+        cursor = User.migrate_keys_batch(self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(url='/tasks/migrate_user_keys',
+                          params={'cursor': cursor})
+        self.response.set_status(204)
+
+
+class BackfillCounters(webapp2.RequestHandler):
+    def post(self):
+        """Seed the game counters, which started at zero, with the games
+        that ended before they existed. Run once after deploying them."""
+        ended = Game.query(Game.game_over == True)
+        counters.backfill(counters.GAMES_OVER, ended.count())
+        counters.backfill(counters.GAMES_WON_BY_X,
+                          ended.filter(Game.winner == "X").count())
+        self.response.set_status(204)
+
+
+class RpcStats(webapp2.RequestHandler):
+    def get(self):
+        """Report the calls of each endpoint and its RPCs per call since the
+        counters were last reset. ?reset=1 clears them."""
+        rpcstats.flush()
+        names = sorted(TicTacToeApi.all_remote_methods())
+        endpoint_totals = rpcstats.totals(names)
+        if self.request.get('reset'):
+            rpcstats.reset(names)
+        fields = rpcstats.FIELDS[1:]
+        lines = ['{:<24}{:>8}'.format('endpoint', 'calls') +
+                 ''.join('{:>12}'.format(field) for field in fields)]
+        for name in names:
+            counts = endpoint_totals[name]
+            calls = counts['calls'] or 1
+            lines.append('{:<24}{:>8}'.format(name, counts['calls']) +
+                         ''.join('{:>12.2f}'.format(float(counts[field]) /
+                                                    calls)
+                                 for field in fields))
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('\n'.join(lines) + '\n')
+
+
+class LatencyReport(webapp2.RequestHandler):
+    def get(self):
+        """Report the p50, p95 and p99 wall time, CPU time and response size
+        of each endpoint across instances. ?reset=1 clears them."""
+        latency.flush()
+        methods = sorted(TicTacToeApi.all_remote_methods())
+        report = latency.report(methods)
+        if self.request.get('reset'):
+            latency.reset(methods)
+        lines = ['{:<24}{:<10}{:>8}'.format('endpoint', 'metric', 'count') +
+                 ''.join('{:>10}'.format('p{}'.format(p))
+                         for p in latency.PERCENTILES)]
+        for method in methods:
+            for metric, _ in latency.METRICS:
+                summary = report[method][metric]
+                lines.append('{:<24}{:<10}{:>8}'.format(
+                    method, metric, summary['count']) + ''.join(
+                        '{:>10}'.format(summary['p{}'.format(p)])
+                        for p in latency.PERCENTILES))
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('\n'.join(lines) + '\n')
+
+
+class Warmup(webapp2.RequestHandler):
+    def get(self):
+        """Open the robot's solver book before the instance takes
+        traffic and report what it cost."""
+        solver.get_book()
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.write('source: {source}\n'
+                            'load_seconds: {load_seconds:.3f}\n'
+                            'bytes: {bytes}\n'.format(**solver.stats()))
+
+
 app = webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail),
+    (REMINDER_SHARD_URL, SendReminderShard),
     ('/tasks/cache_average_win_rates', UpdateAverageWinRates),
+    ('/crons/snapshot_leaderboard', SnapshotLeaderboard),
+    (leaderboard.REBUILD_URL, RebuildLeaderboard),
+    ('/crons/checkpoint_games', CheckpointGames),
+    (CHECKPOINT_SHARD_URL, CheckpointShard),
+    ('/tasks/migrate_history', MigrateHistory),
+    ('/tasks/migrate_user_keys', MigrateUserKeys),
+    ('/tasks/backfill_counters', BackfillCounters),
+    ('/admin/rpcstats', RpcStats),
+    ('/admin/latency', LatencyReport),
+    ('/_ah/warmup', Warmup),
 ], debug=True)
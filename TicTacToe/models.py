@@ -2,27 +2,168 @@
 entities used by the Game. Because these classes are also regular Python
 classes they can include methods (such as 'to_form' and 'new_game')."""
 
+import binascii
+import logging
 import random
 from datetime import date, datetime
 from protorpc import messages
 from google.appengine.ext import ndb
+from google.appengine.datastore import entity_pb
+from google.appengine.datastore.datastore_query import Cursor
 
+import counters
+import engine
+import leaderboard
+from cache import entity_cache
 
 
 
 
 
+
+def user_names(entities):
+    """Returns {user key: user name} for the users referenced by entities,
+    fetched with a single batched get"""
+    return user_names_async(entities).get_result()
+
+
+@ndb.tasklet
+def user_names_async(entities):
+    """Tasklet version of user_names"""
+    keys = list(set(entity.user for entity in entities))
+    # names never change, and an eventually consistent get is not split
+    # into one RPC per 10 entity groups
+    users = yield ndb.get_multi_async(
+        keys, read_policy=ndb.EVENTUAL_CONSISTENCY)
+    raise ndb.Return(dict((user.key, user.name) for user in users if user))
+
+
+# Users created before they were keyed by name are still found by query.
+# Set to False once /tasks/migrate_user_keys has finished.
+LEGACY_USER_LOOKUP = True
+
+
 class User(ndb.Model):
-    """User profile"""
+    """User profile, keyed by the normalized user name"""
     name = ndb.StringProperty(required=True)
     email = ndb.StringProperty()
     wins = ndb.IntegerProperty(required=True)
     total = ndb.IntegerProperty(required=True)
     rate = ndb.FloatProperty(required=True)
 
-    def to_form(self):
+    @staticmethod
+    def normalize(name):
+        """Returns the key id of a user name"""
+        return name.strip().lower()
+
+    @classmethod
+    def key_for(cls, name):
+        """Returns the key of the user called name"""
+        return ndb.Key(cls, cls.normalize(name))
+
+    @classmethod
+    def get_by_name(cls, name):
+        """Returns the user called name, or None"""
+        return cls.get_by_name_async(name).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def get_by_name_async(cls, name):
+        """Tasklet version of get_by_name"""
+        user = yield cls.key_for(name).get_async()
+        if user is None and LEGACY_USER_LOOKUP:
+            user = yield cls.query(cls.name == name).get_async()
+        raise ndb.Return(user)
+
+    @classmethod
+    def create(cls, name, email):
+        """Creates and returns a new user, or returns None if the name is
+        taken. The check and the insert run in one transaction, as
+        get_or_insert does, so two requests cannot both create the name."""
+        return cls.create_async(name, email).get_result()
+
+    @classmethod
+    @ndb.transactional_tasklet
+    def create_async(cls, name, email):
+        """Tasklet version of create"""
+        key = cls.key_for(name)
+        if (yield key.get_async()):
+            raise ndb.Return(None)
+        user = cls(key=key, name=name, email=email, wins=0, total=0, rate=0)
+        yield user.put_async()
+        raise ndb.Return(user)
+
+    @classmethod
+    def migrate_keys_batch(cls, urlsafe_cursor=None, batch_size=20):
+        """Re-keys a batch of users created with numeric ids by their
+        normalized name and points their games and scores at the new key.
+        The totals move over last, in the transaction that deletes the
+        legacy user, so games ending meanwhile are counted on whichever key
+        they point at, and a retried task finishes a half-moved user.
+        Returns the urlsafe cursor of the next batch, or None when there is
+        nothing left."""
+        cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+        users, next_cursor, more = cls.query().fetch_page(
+            batch_size, start_cursor=cursor)
+        for user in users:
+            if user.key.id() == cls.normalize(user.name):
+                continue
+            new_key = cls._start_rekey(user.key)
+            if new_key is None:
+                continue
+            for model in (Game, Score):
+                query = model.query(model.user == user.key)
+                page, page_cursor, page_more = query.fetch_page(500)
+                while page:
+                    for entity in page:
+                        entity.user = new_key
+                    ndb.put_multi(page)
+                    if not page_more:
+                        break
+                    page, page_cursor, page_more = query.fetch_page(
+                        500, start_cursor=page_cursor)
+            cls._finish_rekey(user.key, new_key)
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def _start_rekey(cls, old_key):
+        """Returns the new key of a legacy user, creating a user with no
+        games there unless an earlier attempt did. Returns None if the name
+        is taken by another user."""
+        user = old_key.get()
+        if user is None:
+            return None
+        new_key = cls.key_for(user.name)
+        existing = new_key.get()
+        if existing is None:
+            cls(key=new_key, name=user.name, email=user.email, wins=0,
+                total=0, rate=0).put()
+        elif existing.name != user.name or existing.email != user.email:
+            logging.warning('not re-keying user %s: %s is taken',
+                            old_key.id(), new_key.id())
+            return None
+        return new_key
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def _finish_rekey(cls, old_key, new_key):
+        """Adds the totals of a legacy user to its new key and deletes it"""
+        user, new_user = ndb.get_multi([old_key, new_key])
+        if user is None:
+            return
+        new_user.wins += user.wins
+        new_user.total += user.total
+        new_user.rate = (float(new_user.wins) / new_user.total
+                         if new_user.total else 0)
+        new_user.put()
+        old_key.delete()
+
+    def to_form(self, rank=None):
         """Returns a User Form representation of the Game"""
         form = UserForm()
+        form.rank = rank
         form.name = self.name
         form.wins=self.wins
         form.total = self.total
@@ -36,11 +177,13 @@ class UserForm(messages.Message):
     wins = messages.IntegerField(2, required=True)
     total = messages.IntegerField(3, required=True)
     rate = messages.FloatField(4, required=True)
+    rank = messages.IntegerField(5)
 
 
 class UserForms(messages.Message):
     """Multi GameForms"""
     items = messages.MessageField(UserForm, 1, repeated=True)
+    next_page_token = messages.StringField(2)
     
 
 
@@ -50,80 +193,265 @@ class UserForms(messages.Message):
 
 
 class History(ndb.Model):
-    """Game History"""
+    """Game History, one row per move. Only read to fold the rows of old
+    games into their move logs."""
     game = ndb.KeyProperty(required=True, kind="Game")
     move = ndb.IntegerProperty(required=True)
     result = ndb.StringProperty(required=True)
     datetime = ndb.DateTimeProperty(required=True)
     player = ndb.StringProperty(required=True)
 
-    def to_form(self):
-        """Returns a hisotry form representation of the game history"""
-        form = HistoryForm()
-        form.move = self.move
-        form.result = self.result
-        form.player = self.player
-        form.datetime=self.datetime.strftime("%Y-%m-%d %H:%M:%S")
-        return form
+    @classmethod
+    def migrate_batch(cls, urlsafe_cursor=None, batch_size=100):
+        """Folds the History rows of a batch of games into their move logs.
+        Returns the urlsafe cursor of the next batch, or None when there is
+        nothing left."""
+        cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+        rows, next_cursor, more = cls.query(
+            projection=[cls.game], distinct=True).fetch_page(
+                batch_size, start_cursor=cursor)
+        for row in rows:
+            cls.fold(row.game, cls.query(cls.game == row.game).fetch(
+                keys_only=True))
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+
+    @classmethod
+    @ndb.transactional(xg=True)
+    def fold(cls, game_key, keys):
+        """Puts the History rows of keys in front of the moves of their
+        game, which came after them, and deletes the rows in the same
+        transaction, so a retried task cannot fold them twice. Rows of
+        cancelled games are simply dropped."""
+        histories = sorted((history for history in ndb.get_multi(keys)
+                            if history), key=lambda history: history.datetime)
+        game = game_key.get()
+        if game and histories:
+            game.moves = ''.join(pack_move(history.move, history.player,
+                                           history.result, game.move_width)
+                                 for history in histories) + game.moves
+            game.put()
+        ndb.delete_multi([history.key for history in histories])
 
 
 class HistoryForm(messages.Message):
     """History Form"""
     move = messages.IntegerField(1, required=True)
     result = messages.StringField(2, required=True)
-    datetime = messages.StringField(3)
+    # field 3 was the move's datetime, which the move log does not keep
     player = messages.StringField(4)
 
 
 class HistoryForms(messages.Message):
     """History Forms"""
     items = messages.MessageField(HistoryForm, 1, repeated=True)
+    next_page_token = messages.StringField(2)
+
+
 
 
 
 
 
 
+# A move is packed into one byte of Game.moves: the cell in bits 0-3, the
+# player in bit 4 and the result in bits 5-6. Boards of more than 16 cells
+# take two bytes per move, big-endian: the cell in bits 0-12, the player in
+# bit 13 and the result in bits 14-15.
+MOVE_PLAYERS = ("X", "O")
+MOVE_RESULTS = ("keep moving.", "You win!", "You lose!", "Tie!")
+
+
+def move_width(size):
+    """Returns the bytes per move in the move log of a size x size board"""
+    return 1 if size * size <= 16 else 2
+
+
+def pack_move(pos, player, result, width=1):
+    """Returns the move log record of a move"""
+    player, result = MOVE_PLAYERS.index(player), MOVE_RESULTS.index(result)
+    if width == 1:
+        return chr(pos | player << 4 | result << 5)
+    record = pos | player << 13 | result << 14
+    return chr(record >> 8) + chr(record & 0xff)
+
+
+def unpack_moves(moves, width=1):
+    """Returns the (cell, player, result) of each record of a move log"""
+    if width == 1:
+        return [(ord(move) & 0xf, MOVE_PLAYERS[ord(move) >> 4 & 1],
+                 MOVE_RESULTS[ord(move) >> 5 & 3]) for move in moves]
+    records = [ord(moves[i]) << 8 | ord(moves[i + 1])
+               for i in range(0, len(moves), 2)]
+    return [(record & 0x1fff, MOVE_PLAYERS[record >> 13 & 1],
+             MOVE_RESULTS[record >> 14 & 3]) for record in records]
+
+
+class BoardProperty(ndb.IntegerProperty):
+    """A board packed by engine.pack. Accepts a board string too, and
+    reads the string boards of games stored before boards were packed; they
+    are written back packed on their next put. Boards too large for an
+    int64 are stored as a big-endian blob."""
+
+    def _validate(self, value):
+        if isinstance(value, basestring):
+            x, o = engine.from_string(value)
+            return engine.pack(x, o, int(len(value) ** 0.5))
+
+    def _db_set_value(self, v, p, value):
+        if value < 1 << 63:
+            return super(BoardProperty, self)._db_set_value(v, p, value)
+        p.set_meaning(entity_pb.Property.BLOB)
+        digits = '%x' % value
+        v.set_stringvalue(binascii.unhexlify('0' * (len(digits) % 2) +
+                                             digits))
+
+    def _db_get_value(self, v, p):
+        if not v.has_stringvalue():
+            return super(BoardProperty, self)._db_get_value(v, p)
+        if p.meaning() == entity_pb.Property.BLOB:
+            return int(binascii.hexlify(v.stringvalue()), 16)
+        return engine.pack(*engine.from_string(v.stringvalue()))
 
 
 class Game(ndb.Model):
     """Game object"""
     game_over = ndb.BooleanProperty(required=True, default=False)
     user = ndb.KeyProperty(required=True, kind='User')
-    board = ndb.StringProperty()
+    board = BoardProperty(default=0, indexed=False)
+    # the board is size x size, won with k in a row
+    size = ndb.IntegerProperty(default=engine.SIZE, indexed=False)
+    k = ndb.IntegerProperty(default=engine.K, indexed=False)
     winner = ndb.StringProperty()
     message = ndb.StringProperty()
+    difficulty = ndb.StringProperty(default='EASY')
+    moves = ndb.BlobProperty(default='')
+    # buffer moves in memcache between checkpoints, see hotstore.py
+    write_behind = ndb.BooleanProperty(default=False)
+
+    def _post_put_hook(self, future):
+        entity_cache.invalidate(self.key)
+
+    @classmethod
+    def _post_delete_hook(cls, key, future):
+        entity_cache.invalidate(key)
 
     @classmethod
-    def new_game(cls, user, message): #, min, max, attempts):
+    def new_game(cls, user, message, difficulty='EASY',
+                 write_behind=False, size=engine.SIZE,
+                 k=engine.K): #, min, max, attempts):
         """Creates and returns a new game"""
+        return cls.new_game_async(user, message, difficulty,
+                                  write_behind, size, k).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def new_game_async(cls, user, message, difficulty='EASY',
+                       write_behind=False, size=engine.SIZE, k=engine.K):
+        """Tasklet version of new_game"""
         game = Game(user=user,
-                    board="---------",
+                    board=0,
+                    size=size,
+                    k=k,
                     message=message,
+                    difficulty=difficulty,
+                    write_behind=write_behind,
                     game_over=False)
-        game.put()
-        return game
+        yield game.put_async()
+        raise ndb.Return(game)
 
-    def to_form(self):
-        """Returns a GameForm representation of the Game"""
+    @classmethod
+    def users_with_open_games(cls, urlsafe_cursor=None, batch_size=100):
+        """Returns the keys of a batch of users with unfinished games, each
+        user once, and the urlsafe cursor of the next batch or None when
+        there is nothing left. Served by the (game_over, user) index."""
+        cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+        games, next_cursor, more = cls.query(
+            cls.game_over == False, projection=[cls.user],
+            distinct=True).fetch_page(batch_size, start_cursor=cursor)
+        keys = [game.user for game in games]
+        if more and next_cursor:
+            return keys, next_cursor.urlsafe()
+        return keys, None
+
+    def to_form(self, user_name=None):
+        """Returns a GameForm representation of the Game. Pass user_name
+        when it is already known to skip fetching the user."""
         form = GameForm()
         form.urlsafe_key = self.key.urlsafe()
-        form.user_name = self.user.get().name
+        form.user_name = user_name or self.user.get().name
         form.game_over = self.game_over
         form.message = self.message
-        form.board = self.board
+        x, o = engine.unpack(self.board, self.size)
+        form.board = engine.to_string(x, o, self.size)
+        form.size = self.size
+        form.k = self.k
         form.winner = self.winner
+        form.difficulty = Difficulty(self.difficulty)
         return form
 
+    @classmethod
+    def to_forms(cls, games, next_page_token=None):
+        """Returns GameForms for games, fetching their users in one batch"""
+        return cls.to_forms_async(games, next_page_token).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def to_forms_async(cls, games, next_page_token=None):
+        """Tasklet version of to_forms"""
+        games = list(games)
+        names = yield user_names_async(games)
+        raise ndb.Return(GameForms(items=[game.to_form(names.get(game.user))
+                                          for game in games],
+                                   next_page_token=next_page_token))
+
+    @property
+    def move_width(self):
+        """Bytes per move in the move log"""
+        return move_width(self.size)
+
+    def add_move(self, pos, player, result):
+        """Appends a move to the packed move log"""
+        self.moves += pack_move(pos, player, result, self.move_width)
+
+    def history_forms(self, page_size, page_token=None):
+        """Returns a page of the move log as HistoryForms. The page token is
+        the offset of the first move of the page. Raises ValueError for a
+        token that is not one."""
+        start = int(page_token or 0)
+        if start < 0:
+            raise ValueError('negative page token')
+        width = self.move_width
+        moves = unpack_moves(
+            self.moves[start * width:(start + page_size) * width], width)
+        next_start = start + len(moves)
+        return HistoryForms(items=[
+            HistoryForm(move=pos, player=player, result=result)
+            for pos, player, result in moves],
+            next_page_token=(str(next_start)
+                             if next_start * width < len(self.moves)
+                             else None))
+
     def end_game(self, winner, message):
-        """Ends the game - if won is True, the player won. - if won is False,
-        the player lost."""
+        """Ends the game - winner is "X", "O" or None for a tie. Updates the
+        game, its user and the game counters and records a Score. Nothing is
+        written here: every changed entity is returned so the caller can
+        commit them together in one cross-group transaction, and the
+        leaderboard is only updated once that transaction commits."""
+        return self.end_game_async(winner, message).get_result()
+
+    @ndb.tasklet
+    def end_game_async(self, winner, message):
+        """Tasklet version of end_game. The user and the counter shards are
+        fetched in parallel. The Score is named after the game, so that
+        every returned entity has a complete key and one Put writes them
+        all."""
         self.message = message
         self.winner = winner
         self.game_over = True
-        self.put()
         # Add the game to the score 'board'    
-        score = Score(user=self.user, date=date.today(), winner=winner) #,
+        score = Score(id='game-{}'.format(self.key.id()), user=self.user,
+                      date=date.today(), winner=winner) #,
                     #   guesses=self.attempts_allowed - self.attempts_remaining)
         if (winner == "X"):
             score.point = 1
@@ -131,14 +459,22 @@ class Game(ndb.Model):
             score.point = -1
         else: 
             score.point = 0
-        score.put()
+        fetches = [self.user.get_async(),
+                   counters.increment_async(counters.GAMES_OVER)]
+        if (winner == "X"):
+            fetches.append(counters.increment_async(counters.GAMES_WON_BY_X))
+        fetched = yield fetches
+        user, shards = fetched[0], fetched[1:]
         # set user wins
-        user = self.user.get()    
+        old_entry = leaderboard.entry(user)
         if (winner == "X"):
             user.wins += 1
         user.total += 1
         user.rate = float(user.wins)/user.total
-        user.put()
+        new_entry = leaderboard.entry(user)
+        ndb.get_context().call_on_commit(
+            lambda: leaderboard.update(old_entry, new_entry))
+        raise ndb.Return([self, score, user] + shards)
 
 
 class GameForm(messages.Message):
@@ -149,11 +485,15 @@ class GameForm(messages.Message):
     message = messages.StringField(4, required=True)
     user_name = messages.StringField(5, required=True)
     board = messages.StringField(6, required=True)
+    difficulty = messages.EnumField('Difficulty', 7)
+    size = messages.IntegerField(8)
+    k = messages.IntegerField(9)
 
 
 class GameForms(messages.Message):
     """Multi GameForms"""
     items = messages.MessageField(GameForm, 1, repeated=True)
+    next_page_token = messages.StringField(2)
 
 
 class CancelGameForm(messages.Message):
@@ -161,9 +501,20 @@ class CancelGameForm(messages.Message):
     message = messages.StringField(1, required=True)
     
 
+class Difficulty(messages.Enum):
+    """Robot strength"""
+    EASY = 1
+    MEDIUM = 2
+    PERFECT = 3
+
+
 class NewGameForm(messages.Message):
     """Used to create a new game"""
     user_name = messages.StringField(1, required=True)
+    difficulty = messages.EnumField('Difficulty', 2, default='EASY')
+    write_behind = messages.BooleanField(3, default=False)
+    size = messages.IntegerField(4, default=3)
+    k = messages.IntegerField(5, default=3)
 
 
 class MakeMoveForm(messages.Message):
@@ -185,9 +536,27 @@ class Score(ndb.Model):
     point = ndb.IntegerProperty(required=True)
     # guesses = ndb.IntegerProperty(required=True)
 
-    def to_form(self):
-        return ScoreForm(user_name=self.user.get().name, winner=self.winner,
-                         date=str(self.date), point=self.point) #, guesses=self.guesses)
+    def to_form(self, user_name=None):
+        """Returns a ScoreForm representation of the Score. Pass user_name
+        when it is already known to skip fetching the user."""
+        return ScoreForm(user_name=user_name or self.user.get().name,
+                         winner=self.winner, date=str(self.date),
+                         point=self.point) #, guesses=self.guesses)
+
+    @classmethod
+    def to_forms(cls, scores, next_page_token=None):
+        """Returns ScoreForms for scores, fetching their users in one batch"""
+        return cls.to_forms_async(scores, next_page_token).get_result()
+
+    @classmethod
+    @ndb.tasklet
+    def to_forms_async(cls, scores, next_page_token=None):
+        """Tasklet version of to_forms"""
+        scores = list(scores)
+        names = yield user_names_async(scores)
+        raise ndb.Return(ScoreForms(
+            items=[score.to_form(names.get(score.user)) for score in scores],
+            next_page_token=next_page_token))
 
 
 class ScoreForm(messages.Message):
@@ -202,6 +571,7 @@ class ScoreForm(messages.Message):
 class ScoreForms(messages.Message):
     """Return multiple ScoreForms"""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
+    next_page_token = messages.StringField(2)
 
 
 
@@ -0,0 +1,49 @@
+"""robot.py - Move policies for the computer player.
+
+EASY plays a random free cell, MEDIUM takes a winning cell or blocks the
+opponent's before falling back to random, PERFECT plays from the solver
+table. The solver only covers the standard board, so PERFECT plays MEDIUM
+on the larger variants."""
+
+import random
+
+import engine
+import solver
+
+
+EASY = 'EASY'
+MEDIUM = 'MEDIUM'
+PERFECT = 'PERFECT'
+LEVELS = (EASY, MEDIUM, PERFECT)
+
+
+def _random(mine, theirs, rng, size):
+    return rng.choice(engine.free_cells(mine, theirs, size))
+
+
+def _medium(mine, theirs, rng, size, k):
+    spaces = engine.free_cells(mine, theirs, size)
+    standard = size == engine.SIZE and k == engine.K
+    for side in (mine, theirs):
+        for pos in spaces:
+            if standard:
+                if engine.WINS[side | 1 << pos]:
+                    return pos
+            elif engine.wins_at(engine.place(side, pos), pos, size, k):
+                return pos
+    return rng.choice(spaces)
+
+
+def choose_move(level, x, o, chessman, rng=random, size=engine.SIZE,
+                k=engine.K):
+    """Returns the cell chessman plays at the given level on the (x, o)
+    board. The board must have at least one free cell."""
+    mine, theirs = (x, o) if chessman == "X" else (o, x)
+    if level == PERFECT and size == engine.SIZE and k == engine.K and \
+            solver.side_to_move(x, o) == chessman:
+        move = solver.best_move(x, o)
+        if move is not None:
+            return move
+    if level == EASY:
+        return _random(mine, theirs, rng, size)
+    return _medium(mine, theirs, rng, size, k)
@@ -0,0 +1,202 @@
+"""rpcstats.py - Per-request accounting of datastore and memcache RPCs.
+
+An API proxy pre-call hook counts every RPC the current request makes:
+datastore gets, puts, deletes, query batches and transaction calls, each
+also by kind, and memcache calls. accounted() wraps an endpoint method; when
+the call returns it logs a one-line JSON summary, warns when one kind was
+fetched by key in more than N_PLUS_ONE_GETS separate Get calls (a loop of
+get() where one get_multi would do) and adds the counts to per-endpoint
+totals kept per instance in memory. As latency.py does, at most every
+FLUSH_SECONDS the next call adds them to the totals in memcache with one
+offset_multi, which /admin/rpcstats reports."""
+
+import collections
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+
+N_PLUS_ONE_GETS = 5
+FLUSH_SECONDS = 60
+HOOK_NAME = 'rpcstats'
+MEMCACHE_PREFIX = 'RPCSTATS-'
+
+DATASTORE_CALLS = {'Get': 'get', 'Put': 'put', 'Delete': 'delete',
+                   'RunQuery': 'query', 'Next': 'query',
+                   'BeginTransaction': 'transaction',
+                   'Commit': 'transaction', 'Rollback': 'transaction'}
+# the per-endpoint totals kept in memcache
+FIELDS = ('calls', 'get', 'put', 'delete', 'query', 'transaction',
+          'memcache', 'other', 'n_plus_one')
+
+_local = threading.local()
+_lock = threading.Lock()
+# {(endpoint, field): count} since the last flush
+_pending = {}
+_last_flush = [time.time()]
+
+
+def _kind(reference):
+    return reference.path().element_list()[-1].type()
+
+
+class RequestStats(object):
+    """The RPCs made by one request"""
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = collections.Counter()
+        # Get calls that fetched the kind, however many keys each had
+        self.gets_by_kind = collections.Counter()
+        self.keys_by_kind = collections.Counter()
+        self.puts_by_kind = collections.Counter()
+        self.queries_by_kind = collections.Counter()
+
+    def add(self, service, call, request):
+        """Counts one RPC"""
+        if service == 'memcache':
+            self.counts['memcache'] += 1
+        elif service == 'datastore_v3' and call in DATASTORE_CALLS:
+            self.counts[DATASTORE_CALLS[call]] += 1
+            if call == 'Get':
+                kinds = collections.Counter(_kind(key)
+                                            for key in request.key_list())
+                self.gets_by_kind.update(kinds.keys())
+                self.keys_by_kind.update(kinds)
+            elif call == 'Put':
+                self.puts_by_kind.update(_kind(entity.key())
+                                         for entity in request.entity_list())
+            elif call == 'RunQuery':
+                self.queries_by_kind[request.kind()] += 1
+        else:
+            self.counts['other'] += 1
+
+    def n_plus_one(self, threshold=N_PLUS_ONE_GETS):
+        """Returns the kinds fetched in more than threshold Get calls"""
+        return sorted(kind for kind, gets in self.gets_by_kind.items()
+                      if gets > threshold)
+
+    def summary(self):
+        """Returns the counts as a JSON-ready dict"""
+        summary = dict((field, self.counts[field]) for field in FIELDS
+                       if field in self.counts)
+        summary.update(endpoint=self.name,
+                       gets_by_kind=dict(self.gets_by_kind),
+                       keys_by_kind=dict(self.keys_by_kind),
+                       puts_by_kind=dict(self.puts_by_kind),
+                       queries_by_kind=dict(self.queries_by_kind),
+                       n_plus_one=self.n_plus_one())
+        return summary
+
+
+def _active():
+    """Returns the RequestStats recording on this thread, outermost first"""
+    if not hasattr(_local, 'active'):
+        _local.active = []
+    return _local.active
+
+
+def _hook(service, call, request, response):
+    for stats in _active():
+        stats.add(service, call, request)
+
+
+def install():
+    """Adds the hook to the current API proxy; does nothing if it is
+    already there"""
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(HOOK_NAME, _hook)
+
+
+@contextlib.contextmanager
+def record(name):
+    """Counts the RPCs made by this thread inside the block into the
+    RequestStats it yields. Blocks nest: an RPC counts in every enclosing
+    one."""
+    install()
+    stats = RequestStats(name)
+    _active().append(stats)
+    try:
+        yield stats
+    finally:
+        _active().remove(stats)
+
+
+def report(stats):
+    """Logs the summary of a request and adds it to the endpoint totals"""
+    summary = stats.summary()
+    logging.info('rpcstats %s', json.dumps(summary, sort_keys=True))
+    if summary['n_plus_one']:
+        logging.warning('possible N+1 in %s: %s fetched by key in more than '
+                        '%d calls', stats.name,
+                        ', '.join(summary['n_plus_one']), N_PLUS_ONE_GETS)
+    totals = dict((field, stats.counts[field]) for field in FIELDS
+                  if stats.counts[field])
+    totals['calls'] = 1
+    if summary['n_plus_one']:
+        totals['n_plus_one'] = 1
+    with _lock:
+        for field, count in totals.items():
+            key = (stats.name, field)
+            _pending[key] = _pending.get(key, 0) + count
+        if time.time() - _last_flush[0] < FLUSH_SECONDS:
+            return
+        pending = dict(_pending)
+        _pending.clear()
+        _last_flush[0] = time.time()
+    flush(pending)
+
+
+def flush(pending=None):
+    """Adds the totals counted since the last flush to memcache"""
+    if pending is None:
+        with _lock:
+            pending = dict(_pending)
+            _pending.clear()
+            _last_flush[0] = time.time()
+    if not pending:
+        return
+    offsets = dict((_prefix(name) + field, count)
+                   for (name, field), count in pending.items())
+    if memcache.offset_multi(offsets, initial_value=0) is None:
+        logging.warning('dropped rpcstats totals of %d counters',
+                        len(offsets))
+
+
+def _prefix(name):
+    return '{}{}-'.format(MEMCACHE_PREFIX, name)
+
+
+def accounted(method):
+    """Decorates an endpoint method to account for the RPCs of each call"""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            with record(method.__name__) as stats:
+                return method(*args, **kwargs)
+        finally:
+            # outside the block, so the report's own memcache call is not
+            # counted
+            report(stats)
+    return wrapper
+
+
+def totals(names):
+    """Returns {name: {field: count}} of the accounted endpoints, read in
+    one memcache call"""
+    cached = memcache.get_multi([_prefix(name) + field
+                                 for name in names for field in FIELDS])
+    return dict((name, dict((field, cached.get(_prefix(name) + field, 0))
+                            for field in FIELDS))
+                for name in names)
+
+
+def reset(names):
+    """Drops the totals of the named endpoints"""
+    memcache.delete_multi([_prefix(name) + field
+                           for name in names for field in FIELDS])
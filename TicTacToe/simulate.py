@@ -0,0 +1,198 @@
+"""simulate.py - Self-play simulator for robot strategy statistics.
+
+Plays robot against robot with the engine rules and robot policies, without
+the datastore, to measure win, draw and loss rates and the first-move
+advantage over many games. Each matchup is an X policy against an O policy.
+Games are cut into shards of --shard-size, and every shard is played by a
+worker of a multiprocessing pool with its own RNG, seeded from --seed and
+the shard number. A run therefore gives the same totals for any number of
+processes, and the shards share nothing but their small tallies, so
+throughput grows with the cores. Totals are printed as shards finish and
+written as JSON to --output:
+    python simulate.py --games 1000000 --matchup MEDIUM:PERFECT --seed 1"""
+
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+import engine
+import robot
+import solver
+
+
+DEFAULT_SHARD_SIZE = 10000
+RESULTS = ('x_wins', 'o_wins', 'draws')
+
+
+def play(x_level, o_level, rng, size=engine.SIZE, k=engine.K):
+    """Plays one game and returns (result, first move, number of moves)"""
+    levels = (x_level, o_level)
+    x = o = 0
+    first = None
+    for moves in itertools.count():
+        if moves % 2 == 0:
+            pos = robot.choose_move(levels[0], x, o, "X", rng, size, k)
+            x = engine.place(x, pos)
+            won = engine.wins_at(x, pos, size, k)
+        else:
+            pos = robot.choose_move(levels[1], x, o, "O", rng, size, k)
+            o = engine.place(o, pos)
+            won = engine.wins_at(o, pos, size, k)
+        if first is None:
+            first = pos
+        if won:
+            return RESULTS[moves % 2], first, moves + 1
+        if engine.is_full(x, o, size):
+            return 'draws', first, moves + 1
+
+
+def shard_rng(seed, shard):
+    """Returns the RNG of a shard, seeded from the run's seed and the shard
+    number alone"""
+    return random.Random(seed * 1000003 + shard)
+
+
+def play_shard(task):
+    """Plays the games of one shard. Returns (matchup, games, tally) where
+    tally counts the results, the moves and the results by first move."""
+    matchup, shard, games, seed, size, k = task
+    rng = shard_rng(seed, shard)
+    tally = collections.Counter()
+    for _ in range(games):
+        result, first, moves = play(matchup[0], matchup[1], rng, size, k)
+        tally[result] += 1
+        tally['moves'] += moves
+        tally[(first, result)] += 1
+    return matchup, games, tally
+
+
+def tasks(matchups, games, shard_size, seed, size=engine.SIZE, k=engine.K):
+    """Returns the shards of every matchup, numbered across the run"""
+    result = []
+    shard = 0
+    for matchup in matchups:
+        for start in range(0, games, shard_size):
+            result.append((matchup, shard, min(shard_size, games - start),
+                           seed, size, k))
+            shard += 1
+    return result
+
+
+def summary(tallies):
+    """Returns {'X:O': stats} of the matchup tallies"""
+    result = {}
+    for matchup, tally in sorted(tallies.items()):
+        games = sum(tally[name] for name in RESULTS)
+        stats = dict((name, tally[name]) for name in RESULTS)
+        stats.update(games=games,
+                     average_moves=float(tally['moves']) / games)
+        for name in RESULTS:
+            stats[name[:-1] + '_rate'] = float(tally[name]) / games
+        first_moves = {}
+        for key, count in tally.items():
+            if isinstance(key, tuple):
+                entry = first_moves.setdefault(
+                    key[0], dict((name, 0) for name in RESULTS))
+                entry[key[1]] += count
+        for pos, entry in first_moves.items():
+            played = sum(entry.values())
+            entry.update(games=played,
+                         x_win_rate=float(entry['x_wins']) / played)
+        stats['first_moves'] = dict((str(pos), entry)
+                                    for pos, entry in first_moves.items())
+        # X's edge from opening the game
+        stats['first_move_advantage'] = stats['x_win_rate'] - \
+            stats['o_win_rate']
+        result[':'.join(matchup)] = stats
+    return result
+
+
+def run(matchups, games, processes=None, shard_size=DEFAULT_SHARD_SIZE,
+        seed=0, size=engine.SIZE, k=engine.K, progress=None):
+    """Plays games of each (x level, o level) matchup over a pool of
+    processes and returns the summary. progress, if given, is called with
+    the games played so far and the running tallies as each shard ends."""
+    # open the book before forking so the workers share it
+    solver.get_book()
+    # shards are numbered in the order given, so the RNGs do not depend on
+    # dict order
+    matchups = [tuple(matchup) for matchup in matchups]
+    tallies = dict((matchup, collections.Counter()) for matchup in matchups)
+    work = tasks(sorted(tallies, key=matchups.index), games, shard_size,
+                 seed, size, k)
+    played = 0
+    if processes == 1:
+        finished = (play_shard(task) for task in work)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(processes)
+        finished = pool.imap_unordered(play_shard, work)
+    try:
+        for matchup, count, tally in finished:
+            tallies[matchup].update(tally)
+            played += count
+            if progress:
+                progress(played, tallies)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return summary(tallies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--games', type=int, default=100000,
+                        help='games of each matchup')
+    parser.add_argument('--matchup', action='append',
+                        help='X_LEVEL:O_LEVEL, repeatable; every pair of '
+                             'levels by default')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='worker processes; one per core by default')
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--size', type=int, default=engine.SIZE)
+    parser.add_argument('--k', type=int, default=engine.K)
+    parser.add_argument('--output', default='simulate.json')
+    args = parser.parse_args()
+    if args.matchup:
+        matchups = [tuple(item.upper().split(':')) for item in args.matchup]
+    else:
+        matchups = list(itertools.product(robot.LEVELS, repeat=2))
+    for matchup in matchups:
+        if len(matchup) != 2 or not set(matchup) <= set(robot.LEVELS):
+            parser.error('bad matchup {}'.format(':'.join(matchup)))
+    total = args.games * len(matchups)
+    started = time.time()
+
+    def progress(played, tallies):
+        sys.stderr.write('\r{} of {} games, {:.0f} games/s'.format(
+            played, total, played / (time.time() - started)))
+
+    result = run(matchups, args.games, args.processes, args.shard_size,
+                 args.seed, args.size, args.k, progress)
+    sys.stderr.write('\n')
+    elapsed = time.time() - started
+    report = {'games': total, 'seconds': elapsed,
+              'games_per_second': total / elapsed,
+              'processes': args.processes or multiprocessing.cpu_count(),
+              'seed': args.seed, 'size': args.size, 'k': args.k,
+              'matchups': result}
+    for name, stats in sorted(result.items()):
+        print('{:<16} {:>9} games  X {:.3f}  O {:.3f}  draw {:.3f}  '
+              '{:.2f} moves'.format(name, stats['games'],
+                                    stats['x_win_rate'],
+                                    stats['o_win_rate'],
+                                    stats['draw_rate'],
+                                    stats['average_moves']))
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""solver.py - Perfect play book for Tic Tac Toe.
+
+Every position reachable from the empty board is solved with negamax. The
+eight rotations and reflections of a position share its value, so only the
+canonical image of each (engine.canonical) is solved and stored: book.bin
+next to this file holds one fixed-width record per canonical position,
+sorted by its packed board, with the best move on the canonical board, the
+value and the depth to the result for the side to move. A robot reply is a
+binary search of the keys and one record read, the move mapped back through
+the transform.
+
+The book is opened on first use rather than on import, memory-mapped when the
+runtime allows it, and checked against the CRC32 in its header. A missing,
+stale or corrupt book is rebuilt in memory and, where the filesystem is
+writable, written back.
+
+Rebuild the shipped book with:
+    python solver.py"""
+
+import bisect
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+import engine
+
+
+# canonical positions reachable from the empty board
+POSITIONS = 765
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'book.bin')
+BOOK_MAGIC = b'TTTB'
+BOOK_VERSION = 2
+# magic, version, record count, record width, crc32 of the records
+HEADER = struct.Struct('<4sHIHI')
+# canonical packed board, best move on it (-1 when finished), value, depth
+RECORD = struct.Struct('<IbbB')
+
+_lock = threading.Lock()
+_book = None
+_stats = {}
+
+
+class BookError(Exception):
+    """Raised when a book file is missing, stale or corrupt"""
+    pass
+
+
+class Book(object):
+    """Read-only view over the packed records of a book"""
+
+    def __init__(self, data, source):
+        self.data = data
+        self.source = source
+        count = HEADER.unpack_from(data, 0)[2]
+        self.keys = [RECORD.unpack_from(data, HEADER.size +
+                                        i * RECORD.size)[0]
+                     for i in range(count)]
+
+    def record(self, key):
+        """Returns (move, value, depth) for a canonical packed board, or
+        None if it cannot be reached"""
+        index = bisect.bisect_left(self.keys, key)
+        if index == len(self.keys) or self.keys[index] != key:
+            return None
+        return RECORD.unpack_from(self.data, HEADER.size +
+                                  index * RECORD.size)[1:]
+
+    def nbytes(self):
+        return len(self.data)
+
+
+def side_to_move(x, o):
+    """Returns the chessman to move; X always opens"""
+    return "X" if bin(x).count("1") == bin(o).count("1") else "O"
+
+
+def _negamax(records, x, o):
+    key, _ = engine.canonical(x, o)
+    if key in records:
+        return records[key]
+    x, o = engine.unpack(key)
+    x_to_move = side_to_move(x, o) == "X"
+    mine, theirs = (x, o) if x_to_move else (o, x)
+    if engine.is_win(theirs):
+        result = (-1, -1, 0)
+    elif engine.is_full(mine, theirs):
+        result = (-1, 0, 0)
+    else:
+        result, rank = None, None
+        for pos in engine.free_cells(mine, theirs):
+            mine_after = engine.place(mine, pos)
+            _, value, depth = _negamax(
+                records, *((mine_after, theirs) if x_to_move
+                           else (theirs, mine_after)))
+            value, depth = -value, depth + 1
+            # win fastest, lose slowest
+            candidate = (value, -depth if value > 0 else depth)
+            if rank is None or candidate > rank:
+                result, rank = (pos, value, depth), candidate
+    records[key] = result
+    return result
+
+
+def solve():
+    """Returns {canonical packed board: (move, value, depth)} of every
+    reachable position"""
+    records = {}
+    _negamax(records, 0, 0)
+    return records
+
+
+def pack(records):
+    """Returns the book file contents for solved records"""
+    body = b''.join(RECORD.pack(key, *records[key])
+                    for key in sorted(records))
+    return HEADER.pack(BOOK_MAGIC, BOOK_VERSION, len(records), RECORD.size,
+                       zlib.crc32(body) & 0xffffffff) + body
+
+
+def verify(data):
+    """Raises BookError unless data is a current, intact book"""
+    if len(data) < HEADER.size:
+        raise BookError('book is truncated')
+    magic, version, count, width, crc = HEADER.unpack_from(data, 0)
+    if (magic != BOOK_MAGIC or version != BOOK_VERSION or
+            count != POSITIONS or width != RECORD.size):
+        raise BookError('book is stale')
+    if len(data) != HEADER.size + count * width:
+        raise BookError('book is truncated')
+    if zlib.crc32(data[HEADER.size:]) & 0xffffffff != crc:
+        raise BookError('book checksum mismatch')
+
+
+def _map(path):
+    with open(path, 'rb') as f:
+        try:
+            import mmap
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ImportError, EnvironmentError, ValueError):
+            return f.read()
+
+
+def load_book(path=BOOK_PATH):
+    """Returns the Book at path, raising BookError if it is unusable"""
+    try:
+        data = _map(path)
+    except EnvironmentError:
+        raise BookError('book is missing')
+    verify(data)
+    return Book(data, 'file')
+
+
+def write_book(path=BOOK_PATH):
+    """Solves every position and writes the book to path"""
+    data = pack(solve())
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+
+def _rebuild(path):
+    data = pack(solve())
+    try:
+        with open(path, 'wb') as f:
+            f.write(data)
+    except EnvironmentError:
+        logging.warning('could not write rebuilt book to %s', path)
+    return Book(data, 'built')
+
+
+def get_book(path=BOOK_PATH):
+    """Returns the per-instance Book, opening it on first use"""
+    global _book
+    if _book is None:
+        with _lock:
+            if _book is None:
+                started = time.time()
+                try:
+                    book = load_book(path)
+                except BookError as e:
+                    logging.warning('%s, rebuilding: %s', e, path)
+                    book = _rebuild(path)
+                _stats.update(source=book.source,
+                              load_seconds=time.time() - started,
+                              bytes=book.nbytes())
+                logging.info('solver book from %(source)s in '
+                             '%(load_seconds).3fs, %(bytes)d bytes', _stats)
+                _book = book
+    return _book
+
+
+def stats():
+    """Returns where the book came from, how long it took and its size"""
+    return dict(_stats)
+
+
+def _record(x, o):
+    key, t = engine.canonical(x, o)
+    return get_book().record(key), t
+
+
+def best_move(x, o):
+    """Returns the perfect move for the side to move, or None if the
+    position is finished or cannot be reached in a real game"""
+    record, t = _record(x, o)
+    if record is None or record[0] < 0:
+        return None
+    return engine.from_canonical(record[0], t)
+
+
+def value(x, o):
+    """Returns 1, 0 or -1 for the side to move, or None if unreachable"""
+    record, _ = _record(x, o)
+    return record[1] if record is not None else None
+
+
+def depth(x, o):
+    """Returns the number of plies to the result under perfect play, or
+    None if unreachable"""
+    record, _ = _record(x, o)
+    return record[2] if record is not None else None
+
+
+if __name__ == '__main__':
+    data = write_book()
+    print('wrote {} bytes to {}'.format(len(data), BOOK_PATH))
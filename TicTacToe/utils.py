@@ -1,10 +1,20 @@
 """utils.py - File for collecting general utility functions."""
 
 import logging
+import re
+import time
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.api import datastore_errors
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
 import endpoints
 
-def get_by_urlsafe(urlsafe, model):
+COALESCE_WINDOW_SECONDS = 10
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def get_by_urlsafe(urlsafe, model, cache=None):
     """Returns an ndb.Model entity that the urlsafe key points to. Checks
         that the type of entity returned is of the correct kind. Raises an
         error if the key String is malformed or the entity is of the incorrect
@@ -12,11 +22,19 @@ def get_by_urlsafe(urlsafe, model):
     Args:
         urlsafe: A urlsafe key string
         model: The expected entity kind
+        cache: An optional cache.EntityCache to read through. Leave it out
+            for reads that are written back, or inside a transaction.
     Returns:
         The entity that the urlsafe Key string points to or None if no entity
         exists.
     Raises:
         ValueError:"""
+    return get_by_urlsafe_async(urlsafe, model, cache).get_result()
+
+
+@ndb.tasklet
+def get_by_urlsafe_async(urlsafe, model, cache=None):
+    """Tasklet version of get_by_urlsafe"""
     try:
         key = ndb.Key(urlsafe=urlsafe)
     except TypeError:
@@ -27,9 +45,100 @@ def get_by_urlsafe(urlsafe, model):
         else:
             raise
 
-    entity = key.get()
+    entity = yield (cache.get_async(key) if cache else key.get_async())
     if not entity:
-        return None
+        raise ndb.Return(None)
     if not isinstance(entity, model):
         raise ValueError('Incorrect Kind')
-    return entity
+    raise ndb.Return(entity)
+
+
+def page_size(request, default=DEFAULT_PAGE_SIZE, field='page_size'):
+    """Returns the page size asked for by the field of request, capped at
+    MAX_PAGE_SIZE"""
+    size = getattr(request, field)
+    if size is None:
+        return default
+    if size < 1:
+        raise endpoints.BadRequestException(
+            '{} must be positive'.format(field))
+    return min(size, MAX_PAGE_SIZE)
+
+
+def fetch_page(query, request):
+    """Runs query from the request's page_token for one page of results
+    Args:
+        query: An ndb.Query
+        request: A message with page_size and page_token fields
+    Returns:
+        The entities of the page and the next page token, which is None on
+        the last page.
+    Raises:
+        endpoints.BadRequestException: The page token is malformed"""
+    return fetch_page_async(query, request).get_result()
+
+
+@ndb.tasklet
+def fetch_page_async(query, request):
+    """Tasklet version of fetch_page"""
+    try:
+        cursor = Cursor(urlsafe=request.page_token) \
+            if request.page_token else None
+    except datastore_errors.BadValueError:
+        raise endpoints.BadRequestException('Invalid page token')
+    size = page_size(request)
+    try:
+        entities, next_cursor, more = yield query.fetch_page_async(
+            size, start_cursor=cursor)
+    except (datastore_errors.BadValueError, datastore_errors.BadRequestError):
+        # a token that decodes but is not a cursor of this query
+        raise endpoints.BadRequestException('Invalid page token')
+    if more and next_cursor:
+        raise ndb.Return(entities, next_cursor.urlsafe())
+    raise ndb.Return(entities, None)
+
+
+def _dirty_key(url):
+    return 'DIRTY-' + url
+
+
+def schedule_coalesced_task(url, window=COALESCE_WINDOW_SECONDS):
+    """Enqueues a task for url at most once per window. The first caller in
+    a window sets a memcache dirty flag and adds a task named after the
+    window, delayed to the end of it; later callers only count themselves
+    against the flag. A duplicate name is rejected by the queue, so even
+    callers racing past the flag enqueue a single task.
+    Args:
+        url: The task handler url
+        window: Length of the coalescing window in seconds
+    Returns:
+        True if this call enqueued the task, False if it was absorbed."""
+    return schedule_coalesced_task_async(url, window).get_result()
+
+
+@ndb.tasklet
+def schedule_coalesced_task_async(url, window=COALESCE_WINDOW_SECONDS):
+    """Tasklet version of schedule_coalesced_task"""
+    context = ndb.get_context()
+    added = yield context.memcache_add(_dirty_key(url), 0, time=window)
+    if not added:
+        yield context.memcache_incr(_dirty_key(url))
+        raise ndb.Return(False)
+    bucket = int(time.time()) // window
+    name = '{}-{}'.format(re.sub('[^a-zA-Z0-9_-]', '-', url.strip('/')),
+                          bucket)
+    try:
+        yield taskqueue.Queue().add_async(
+            taskqueue.Task(url=url, name=name, countdown=window))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        raise ndb.Return(False)
+    raise ndb.Return(True)
+
+
+def clear_coalesced_task(url):
+    """Clears the dirty flag of url from the task handler
+    Returns:
+        The number of schedule_coalesced_task calls the task absorbed."""
+    absorbed = memcache.get(_dirty_key(url)) or 0
+    memcache.delete(_dirty_key(url))
+    return absorbed
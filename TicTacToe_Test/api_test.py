@@ -1,12 +1,16 @@
 import unittest
 
 import operator
+from datetime import date, datetime
 import os
 
 import import_app_engine
+from google.appengine.api import datastore
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.ext import ndb
 from google.appengine.ext import testbed
+from google.appengine.datastore import datastore_stub_util
 from google.appengine.api import taskqueue
 import endpoints
 from protorpc import message_types
@@ -15,7 +19,13 @@ from protorpc import message_types
 import sys
 sys.path.append("..")
 from TicTacToe.api import *
-from TicTacToe.models import User, Game, Score
+from TicTacToe.models import User, Game, Score, History, Difficulty
+from TicTacToe import counters
+from TicTacToe import leaderboard
+from TicTacToe.utils import clear_coalesced_task
+from TicTacToe.cache import entity_cache
+from TicTacToe import hotstore
+from TicTacToe import engine
 
 
 class TicTacToeApiTestCase(unittest.TestCase):
@@ -24,9 +34,14 @@ class TicTacToeApiTestCase(unittest.TestCase):
         self.api = TicTacToeApi()
         self.testbed = testbed.Testbed()
         self.testbed.activate()
-        self.testbed.init_datastore_v3_stub()
+        # make_move commits in a cross-group transaction, which needs the
+        # High Replication policy.
+        self.policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=self.policy)
         self.testbed.init_memcache_stub()
         ndb.get_context().clear_cache()
+        entity_cache.clear()
         
         # root_path must be set the the location of queue.yaml.
         # Otherwise, only the 'default' queue will be available.
@@ -66,8 +81,58 @@ class TicTacToeApiTestCase(unittest.TestCase):
         # 2.assert
         user = User.query().fetch()[-1];        
         self.assertEqual("lulu", user.name)
+        self.assertEqual(User.key_for("lulu"), user.key)
+
+
+    def test_create_user_name_taken(self):
+        container = USER_REQUEST.combined_message_class(
+                user_name="Lulu",
+                email="amc@xyz")
+        self.api.create_user(container)
+        container.user_name = " lulu"
+        with self.assertRaises(endpoints.ConflictException):
+            self.api.create_user(container)
+        # lisa was created before users were keyed by name
+        container.user_name = "lisa"
+        with self.assertRaises(endpoints.ConflictException):
+            self.api.create_user(container)
+
+
+    def test_migrate_user_keys(self):
+        # 0.arrange
+        Score(user=self.user.key, date=date.today(), point=1).put()
+        # 1.action
+        cursor = User.migrate_keys_batch(batch_size=1)
+        while cursor:
+            cursor = User.migrate_keys_batch(cursor, batch_size=1)
+        # 2.assert
+        self.assertEqual(None, self.user.key.get())
+        user = User.key_for("lisa").get()
+        self.assertEqual("abc@xyz", user.email)
+        self.assertEqual(user.key, self.gameToAdd.key.get().user)
+        self.assertEqual(user.key, Score.query().get().user)
         
-        
+
+    def test_migrate_user_keys_resumes_after_a_failure(self):
+        # 0.arrange
+        self.user.wins, self.user.total, self.user.rate = 1, 2, 0.5
+        self.user.put()
+        # an earlier attempt died after creating the new user
+        new_key = User._start_rekey(self.user.key)
+        # a game of the new key ends while the migration is under way
+        new_user = new_key.get()
+        new_user.wins, new_user.total, new_user.rate = 1, 1, 1.0
+        new_user.put()
+        # 1.action
+        cursor = User.migrate_keys_batch(batch_size=1)
+        while cursor:
+            cursor = User.migrate_keys_batch(cursor, batch_size=1)
+        # 2.assert
+        self.assertEqual(None, self.user.key.get())
+        user = new_key.get()
+        self.assertEqual((2, 3), (user.wins, user.total))
+        self.assertEqual(user.key, self.gameToAdd.key.get().user)
+
  # --- new game -----------------------------
     def test_new_game(self):
         # 0.arrange
@@ -79,9 +144,124 @@ class TicTacToeApiTestCase(unittest.TestCase):
         # 2.assert
         game = Game.query().fetch()[-1]
         self.assertEqual("lisa", game.user.get().name)
-        self.assertEqual("---------", game.board)
+        self.assertEqual(0, game.board)
         self.assertEqual(False, game.game_over)
         self.assertEqual(None, game.winner)
+
+
+    def test_new_game_large_board(self):
+        # 0.arrange
+        container = NEW_GAME_REQUEST.combined_message_class(
+            user_name="lisa", size=15, k=5)
+        # 1.action
+        form = self.api.new_game(container)
+        # 2.assert
+        self.assertEqual(225, len(form.board))
+        self.assertEqual((15, 5), (form.size, form.k))
+
+
+    def test_new_game_invalid_k_exception(self):
+        # 0.arrange
+        container = NEW_GAME_REQUEST.combined_message_class(
+            user_name="lisa", size=4, k=5)
+        # 1.acion
+        # 2.assert
+        with self.assertRaises(endpoints.BadRequestException):
+            self.api.new_game(container)
+
+
+    def test_make_move_large_board_wins_through_last_move(self):
+        # 0.arrange
+        game = Game.new_game(self.user.key, "", size=15, k=5)
+        game.board = engine.pack(sum(1 << pos for pos in (0, 16, 32, 48)),
+                                 1 << 1 | 1 << 2, 15)
+        game.put()
+        container = MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 64,
+            urlsafe_game_key = game.key.urlsafe())
+        # 1.acion
+        form = self.api.make_move(container)
+        # 2.assert
+        self.assertEqual("X", form.winner)
+        self.assertEqual(True, form.game_over)
+        stored = game.key.get(use_cache=False, use_memcache=False)
+        self.assertEqual(form.board, stored.to_form().board)
+        self.assertEqual(2, len(stored.moves))
+        history = self.api.get_game_history(
+            GET_GAME_HISTORY_REQUEST.combined_message_class(
+                urlsafe_game_key=game.key.urlsafe()))
+        self.assertEqual([64], [item.move for item in history.items])
+
+
+    def test_make_move_even_board_robot_fills_last_cell_tie(self):
+        # 0.arrange
+        game = Game.new_game(self.user.key, "", size=4, k=4)
+        game.board = "X-OOOXXXXXOXOOO-"
+        game.put()
+        container = MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 15,
+            urlsafe_game_key = game.key.urlsafe())
+        # 1.acion
+        form = self.api.make_move(container)
+        # 2.assert
+        self.assertEqual("XOOOOXXXXXOXOOOX", form.board)
+        self.assertEqual(True, form.game_over)
+        self.assertEqual(None, form.winner)
+        self.assertEqual("Tie!", form.message)
+        self.assertEqual(1, Score.query(Score.user == self.user.key).count())
+
+
+    def test_make_move_outside_large_board_exception(self):
+        # 0.arrange
+        game = Game.new_game(self.user.key, "", size=4, k=3)
+        container = MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 16,
+            urlsafe_game_key = game.key.urlsafe())
+        # 1.acion
+        # 2.assert
+        with self.assertRaises(endpoints.BadRequestException):
+            self.api.make_move(container)
+
+
+    def test_new_game_coalesces_average_task(self):
+        # 0.arrange
+        container = NEW_GAME_REQUEST.combined_message_class(
+            user_name="lisa")
+        # 1.action
+        for i in range(5):
+            self.api.new_game(container)
+        # 2.assert
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            url=AVERAGE_WIN_RATES_URL)
+        self.assertEqual(1, len(tasks))
+        self.assertEqual(4, clear_coalesced_task(AVERAGE_WIN_RATES_URL))
+
+
+    def test_new_game_perfect_robot(self):
+        # 0.arrange
+        container = NEW_GAME_REQUEST.combined_message_class(
+            user_name="lisa",
+            difficulty=Difficulty.PERFECT)
+        # 1.action
+        form = self.api.new_game(container)
+        # 2.assert
+        game = Game.query().fetch()[-1]
+        self.assertEqual("PERFECT", game.difficulty)
+        self.assertEqual(Difficulty.PERFECT, form.difficulty)
+
+
+    def test_make_move_perfect_robot_blocks(self):
+        # 0.arrange
+        self.gameToAdd.board = "XX--O----"
+        self.gameToAdd.difficulty = "PERFECT"
+        self.gameToAdd.put()
+        container = MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 8,
+            urlsafe_game_key = self.gameToAdd.key.urlsafe())
+        # 1.acion
+        game = self.api.make_move(container)
+        # 2.assert
+        self.assertEqual("XXO-O---X", game.board)
     
     
 # --- get game -------------------------     
@@ -97,6 +277,81 @@ class TicTacToeApiTestCase(unittest.TestCase):
         
         
 
+    def test_get_game_cached(self):
+        # 0.arrange
+        container = GET_GAME_REQUEST.combined_message_class(
+                urlsafe_game_key=self.gameToAdd.key.urlsafe())
+        self.api.get_game(container)
+        misses = entity_cache.stats().get('misses', 0)
+        # 1.action
+        game = self.api.get_game(container)
+        # 2.assert
+        self.assertEqual(misses, entity_cache.stats()['misses'])
+        self.assertEqual("--O-X----", game.board)
+
+
+    def test_get_game_migrates_string_board(self):
+        # 0.arrange
+        legacy = datastore.Entity('Game')
+        legacy.update({'user': self.user.key.to_old_key(),
+                       'board': "--O-X----", 'game_over': False})
+        key = ndb.Key.from_old_key(datastore.Put(legacy))
+        container = GET_GAME_REQUEST.combined_message_class(
+                urlsafe_game_key=key.urlsafe())
+        # 1.action
+        game = self.api.get_game(container)
+        key.get().put()
+        # 2.assert
+        self.assertEqual("--O-X----", game.board)
+        self.assertEqual(engine.pack(0x10, 0x4),
+                         datastore.Get(key.to_old_key())['board'])
+
+
+    def test_get_game_cache_invalidated(self):
+        # 0.arrange
+        container = GET_GAME_REQUEST.combined_message_class(
+                urlsafe_game_key=self.gameToAdd.key.urlsafe())
+        self.api.get_game(container)
+        move = MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 0,
+            urlsafe_game_key = self.gameToAdd.key.urlsafe())
+        self.api.make_move(move)
+        # 1.action
+        game = self.api.get_game(container)
+        # 2.assert
+        self.assertEqual("X", game.board[0])
+        # a cancelled game is cached as missing
+        cancel = CANCEL_GAME_REQUEST.combined_message_class(
+                urlsafe_game_key=self.gameToAdd.key.urlsafe())
+        self.api.cancel_game(cancel)
+        with self.assertRaises(endpoints.NotFoundException):
+            self.api.get_game(container)
+        with self.assertRaises(endpoints.NotFoundException):
+            self.api.get_game(container)
+        self.assertEqual(1, entity_cache.stats()['negative_hits'])
+
+
+    def test_get_game_does_not_cache_a_read_raced_by_a_write(self):
+        # 0.arrange
+        container = GET_GAME_REQUEST.combined_message_class(
+                urlsafe_game_key=self.gameToAdd.key.urlsafe())
+
+        def write_after_read(cls, key, future):
+            # a move commits after the cache read the game, before it fills
+            del Game._post_get_hook
+            game = key.get(use_cache=False, use_memcache=False)
+            game.board = "X-O-X----"
+            game.put()
+        Game._post_get_hook = classmethod(write_after_read)
+        # 1.action
+        stale = self.api.get_game(container)
+        game = self.api.get_game(container)
+        # 2.assert
+        self.assertEqual("--O-X----", stale.board)
+        self.assertEqual("X-O-X----", game.board)
+
+
+
 # todo: do game -----------------------------------
     def test_make_move_done(self):        
         # 0.arrange      
@@ -249,6 +504,25 @@ class TicTacToeApiTestCase(unittest.TestCase):
         self.assertEqual("Tie!", game.message)
 
 
+    def test_make_move_failure_writes_nothing(self):
+        # 0.arrange
+        self.gameToAdd.board = "XXOXXO---"
+        self.gameToAdd.put();
+        self.user.key.delete()
+        container = MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 6,
+            urlsafe_game_key = self.gameToAdd.key.urlsafe())
+        # 1.acion
+        with self.assertRaises(AttributeError):
+            self.api.make_move(container)
+        # 2.assert
+        ndb.get_context().clear_cache()
+        game = self.gameToAdd.key.get()
+        self.assertEqual("XXOXXO---", game.to_form(self.user.name).board)
+        self.assertEqual(False, game.game_over)
+        self.assertEqual(0, Score.query().count())
+
+
     def test_make_move_not_over(self):        
         # 0.arrange      
         self.gameToAdd.board = "---------"
@@ -269,6 +543,115 @@ class TicTacToeApiTestCase(unittest.TestCase):
 
 
 
+    def _new_write_behind_game(self):
+        container = NEW_GAME_REQUEST.combined_message_class(
+            user_name="lisa",
+            write_behind=True)
+        return self.api.new_game(container).urlsafe_key
+
+
+    def test_make_move_write_behind_buffers(self):
+        # 0.arrange
+        urlsafe_key = self._new_write_behind_game()
+        container = MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 4,
+            urlsafe_game_key = urlsafe_key)
+        # 1.acion
+        game = self.api.make_move(container)
+        # 2.assert
+        self.assertEqual("X", game.board[4])
+        self.assertEqual(1, game.board.count("O"))
+        ndb.get_context().clear_cache()
+        stored = ndb.Key(urlsafe=urlsafe_key).get()
+        self.assertEqual(0, stored.board)
+        live = self.api.get_game(GET_GAME_REQUEST.combined_message_class(
+            urlsafe_game_key=urlsafe_key))
+        self.assertEqual(game.board, live.board)
+
+
+    def test_make_move_write_behind_ends(self):
+        # 0.arrange
+        urlsafe_key = self._new_write_behind_game()
+        game = self.api.get_game(GET_GAME_REQUEST.combined_message_class(
+            urlsafe_game_key=urlsafe_key))
+        # 1.acion
+        while not game.game_over:
+            container = MAKE_MOVE_REQUEST.combined_message_class(
+                pos = game.board.index("-"),
+                urlsafe_game_key = urlsafe_key)
+            game = self.api.make_move(container)
+        # 2.assert
+        ndb.get_context().clear_cache()
+        stored = ndb.Key(urlsafe=urlsafe_key).get()
+        self.assertEqual(game.board, stored.to_form().board)
+        self.assertEqual(True, stored.game_over)
+        self.assertEqual(9 - game.board.count("-"), len(stored.moves))
+        self.assertEqual(1, Score.query().count())
+
+
+    def test_checkpoint_write_behind_games(self):
+        # 0.arrange
+        urlsafe_key = self._new_write_behind_game()
+        container = MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 4,
+            urlsafe_game_key = urlsafe_key)
+        game = self.api.make_move(container)
+        # 1.acion
+        written = hotstore.flush_dirty()
+        # 2.assert
+        self.assertEqual(1, written)
+        ndb.get_context().clear_cache()
+        stored = ndb.Key(urlsafe=urlsafe_key).get()
+        self.assertEqual(game.board, stored.to_form().board)
+        self.assertEqual(2, len(stored.moves))
+        game = self.api.make_move(MAKE_MOVE_REQUEST.combined_message_class(
+            pos = game.board.index("-"),
+            urlsafe_game_key = urlsafe_key))
+        self.assertEqual(5, game.board.count("-"))
+
+
+    def test_checkpoint_shard_in_bounded_batches(self):
+        # 0.arrange
+        self.addCleanup(setattr, hotstore, 'DIRTY_SHARDS',
+                        hotstore.DIRTY_SHARDS)
+        hotstore.DIRTY_SHARDS = 1
+        for _ in range(2):
+            self.api.make_move(MAKE_MOVE_REQUEST.combined_message_class(
+                pos = 4,
+                urlsafe_game_key = self._new_write_behind_game()))
+        # 1.acion
+        first = hotstore.flush_shard(0, batch_size=1)
+        second = hotstore.flush_shard(0, batch_size=1)
+        # 2.assert
+        self.assertEqual((1, True), first)
+        self.assertEqual((1, False), second)
+        self.assertEqual((0, False), hotstore.flush_shard(0))
+
+
+    def test_checkpoint_failure_keeps_the_game_dirty(self):
+        # 0.arrange
+        urlsafe_key = self._new_write_behind_game()
+        self.api.make_move(MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 4,
+            urlsafe_game_key = urlsafe_key))
+        shard = hotstore.dirty_shard(ndb.Key(urlsafe=urlsafe_key))
+        checkpoint = hotstore._checkpoint
+        self.addCleanup(setattr, hotstore, '_checkpoint', checkpoint)
+        def fail(live):
+            raise datastore_errors.Timeout()
+        hotstore._checkpoint = fail
+        # 1.acion
+        with self.assertRaises(datastore_errors.Timeout):
+            hotstore.flush_shard(shard)
+        hotstore._checkpoint = checkpoint
+        # 2.assert
+        self.assertEqual([shard], hotstore.dirty_shards())
+        self.assertEqual((1, False), hotstore.flush_shard(shard))
+        self.assertEqual([], hotstore.dirty_shards())
+
+
+
+
 # todo: who is the winner -----------------------------------
     def test_get_winner_the_first_line(self):
         # 0.arrange                   
@@ -345,9 +728,8 @@ class TicTacToeApiTestCase(unittest.TestCase):
 # todo: get scores
     def test_get_scores_no_scores(self):            
         # 0.arrange
-        void_message = message_types.VoidMessage()
         # 1.acion
-        scores = self.api.get_scores(void_message)
+        scores = self.api.get_scores(PAGE_REQUEST.combined_message_class())
         # 2.assert
         self.assertEqual(0, len(scores.items))
 
@@ -361,12 +743,49 @@ class TicTacToeApiTestCase(unittest.TestCase):
             urlsafe_game_key = self.gameToAdd.key.urlsafe())
         game = self.api.make_move(container)
         # 1.acion
-        scores = self.api.get_scores(message_types.VoidMessage())
+        scores = self.api.get_scores(PAGE_REQUEST.combined_message_class())
         # 2.assert
         self.assertEqual(1, len(scores.items))
 
 
     
+    def test_get_scores_user_names(self):
+        # 0.arrange
+        lulu = User(name="lulu", email="amc@xyz", wins=0, total=0, rate=0)
+        lulu.put()
+        Score(user=self.user.key, date=date.today(), winner="X", point=1).put()
+        Score(user=lulu.key, date=date.today(), winner="O", point=-1).put()
+        Score(user=lulu.key, date=date.today(), winner=None, point=0).put()
+        # 1.acion
+        scores = self.api.get_scores(PAGE_REQUEST.combined_message_class())
+        # 2.assert
+        self.assertEqual(["lisa", "lulu", "lulu"],
+                         sorted(score.user_name for score in scores.items))
+
+
+    def test_get_scores_pages(self):
+        # 0.arrange
+        for point in range(5):
+            Score(user=self.user.key, date=date.today(), point=point).put()
+        # 1.acion
+        first = self.api.get_scores(PAGE_REQUEST.combined_message_class(
+            page_size=3))
+        second = self.api.get_scores(PAGE_REQUEST.combined_message_class(
+            page_size=3, page_token=first.next_page_token))
+        # 2.assert
+        self.assertEqual(3, len(first.items))
+        self.assertEqual(2, len(second.items))
+        self.assertEqual(None, second.next_page_token)
+        self.assertEqual(range(5), sorted(score.point for score in
+                                          first.items + second.items))
+
+
+    def test_get_scores_invalid_page_token(self):
+        with self.assertRaises(endpoints.BadRequestException):
+            self.api.get_scores(PAGE_REQUEST.combined_message_class(
+                page_token="not-a-cursor"))
+
+
     def test_get_scores_user_score_one(self):            
         # 0.arrange
         self.gameToAdd.board = "XXOXXO---"
@@ -437,6 +856,14 @@ class TicTacToeApiTestCase(unittest.TestCase):
 
 
 
+    def test_get_high_scores_rejects_non_positive_number(self):
+        for number in (0, -1):
+            with self.assertRaises(endpoints.BadRequestException):
+                self.api.get_high_scores(
+                    HIGH_SCORES_REQUEST.combined_message_class(
+                        number_of_results=number))
+
+
     def test_get_high_scores(self):            
         # 0.arrange
         self.gameToAdd.board = "XXOXXO---"
@@ -463,7 +890,7 @@ class TicTacToeApiTestCase(unittest.TestCase):
             urlsafe_game_key = self.gameToAdd.key.urlsafe())
         game = self.api.make_move(container)
         # 1.acion
-        user_ranks = self.api.get_user_rankings(message_types.VoidMessage())
+        user_ranks = self.api.get_user_rankings(RANKINGS_REQUEST.combined_message_class())
         # 2.assert
         self.assertEqual(1, len(user_ranks.items))
         self.assertEqual(1, user_ranks.items[0].wins)
@@ -474,6 +901,126 @@ class TicTacToeApiTestCase(unittest.TestCase):
 
 
 
+    def test_get_user_rankings_around_me(self):
+        # 0.arrange
+        for i in range(5):
+            User(name="user{}".format(i), wins=i, total=4,
+                 rate=i / 4.0).put()
+        self.api.get_user_rankings(RANKINGS_REQUEST.combined_message_class())
+        self.gameToAdd.board = "XXOXXO---"
+        self.gameToAdd.put();
+        container = MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 6,
+            urlsafe_game_key = self.gameToAdd.key.urlsafe())
+        self.api.make_move(container)
+        # 1.acion
+        user_ranks = self.api.get_user_rankings(
+            RANKINGS_REQUEST.combined_message_class(user_name="user3",
+                                                    window=1))
+        top = self.api.get_user_rankings(
+            RANKINGS_REQUEST.combined_message_class(top_n=2))
+        # 2.assert
+        self.assertEqual(["lisa", "user3", "user2"],
+                         [user.name for user in user_ranks.items])
+        self.assertEqual([2, 3, 4], [user.rank for user in user_ranks.items])
+        self.assertEqual(["user4", "lisa"], [user.name for user in top.items])
+        self.assertEqual("2", top.next_page_token)
+
+
+    def test_get_user_rankings_window_below_the_board(self):
+        # 0.arrange
+        self.addCleanup(setattr, leaderboard, 'LEADERBOARD_SIZE',
+                        leaderboard.LEADERBOARD_SIZE)
+        leaderboard.LEADERBOARD_SIZE = 1
+        User(name="user0", wins=1, total=1, rate=1.0).put()
+        self.api.get_user_rankings(RANKINGS_REQUEST.combined_message_class())
+        # 1.acion
+        ranked = self.api.get_user_rankings(
+            RANKINGS_REQUEST.combined_message_class(user_name="lisa"))
+        # 2.assert
+        self.assertEqual([2], [user.rank for user in ranked.items])
+        with self.assertRaises(endpoints.BadRequestException):
+            self.api.get_user_rankings(
+                RANKINGS_REQUEST.combined_message_class(user_name="lisa",
+                                                        window=1))
+
+
+    def test_leaderboard_drops_a_user_demoted_off_a_full_board(self):
+        # 0.arrange
+        self.addCleanup(setattr, leaderboard, 'LEADERBOARD_SIZE',
+                        leaderboard.LEADERBOARD_SIZE)
+        leaderboard.LEADERBOARD_SIZE = 2
+        users = [User(name="user{}".format(i), wins=i, total=4,
+                      rate=i / 4.0) for i in range(3)]
+        board = leaderboard.rebuild(users)
+        demoted = leaderboard.entry(users[2])
+        users[2].rate = 0.0
+        # 1.acion
+        leaderboard.update(demoted, leaderboard.entry(users[2]))
+        # 2.assert
+        self.assertEqual(board[1:], leaderboard.get_board())
+        self.assertEqual(1, len(self.taskqueue_stub.get_filtered_tasks(
+            url=leaderboard.REBUILD_URL)))
+
+
+    def test_get_user_rankings_rejects_negative_paging(self):
+        # 0.arrange
+        requests = [RANKINGS_REQUEST.combined_message_class(top_n=-1),
+                    RANKINGS_REQUEST.combined_message_class(top_n=0),
+                    RANKINGS_REQUEST.combined_message_class(page_token="-2")]
+        # 1.acion
+        # 2.assert
+        for request in requests:
+            with self.assertRaises(endpoints.BadRequestException):
+                self.api.get_user_rankings(request)
+
+
+    def test_get_average_win_rates(self):
+        # 0.arrange
+        self.gameToAdd.board = "XXOXXO---"
+        self.gameToAdd.put();
+        container = MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 6,
+            urlsafe_game_key = self.gameToAdd.key.urlsafe())
+        self.api.make_move(container)
+        game = Game.new_game(self.user.key, "")
+        game.board = "XXOOXX-OO"
+        game.put()
+        container = MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 6,
+            urlsafe_game_key = game.key.urlsafe())
+        self.api.make_move(container)
+        # 1.acion
+        message = self.api.get_average_win_rates(message_types.VoidMessage())
+        # 2.assert
+        self.assertEqual(2, counters.get_count(counters.GAMES_OVER))
+        self.assertEqual(1, counters.get_count(counters.GAMES_WON_BY_X))
+        self.assertEqual("The average win rate is 0.50", message.message)
+
+
+    def test_backfill_counters(self):
+        # 0.arrange
+        legacy = [Game.new_game(self.user.key, "") for _ in range(3)]
+        for game, winner in zip(legacy, ["X", "O", None]):
+            game.game_over = True
+            game.winner = winner
+        ndb.put_multi(legacy)
+        game = Game.new_game(self.user.key, "")
+        game.board = "XX-OO----"
+        game.put()
+        self.api.make_move(MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 2,
+            urlsafe_game_key = game.key.urlsafe()))
+        self.assertEqual(1, counters.get_count(counters.GAMES_OVER))
+        # 1.acion
+        for _ in range(2):
+            counters.backfill(counters.GAMES_OVER, 4)
+            counters.backfill(counters.GAMES_WON_BY_X, 2)
+        # 2.assert
+        self.assertEqual(4, counters.get_count(counters.GAMES_OVER))
+        self.assertEqual(2, counters.get_count(counters.GAMES_WON_BY_X))
+
+
     def test_game_history(self):
         # 0.arrange
         self.gameToAdd.board = "XXOXXO---"
@@ -493,6 +1040,108 @@ class TicTacToeApiTestCase(unittest.TestCase):
 
 
 
+    def test_game_history_robot_move(self):
+        # 0.arrange
+        container = MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 8,
+            urlsafe_game_key = self.gameToAdd.key.urlsafe())
+        game = self.api.make_move(container)
+        # 1.acion
+        history_request = GET_GAME_HISTORY_REQUEST.combined_message_class(
+            urlsafe_game_key = self.gameToAdd.key.urlsafe())
+        game_histories = self.api.get_game_history(history_request)
+        # 2.assert
+        self.assertEqual(2, len(game_histories.items))
+        self.assertEqual("X", game_histories.items[0].player)
+        self.assertEqual("O", game_histories.items[1].player)
+        self.assertEqual("O", game.board[game_histories.items[1].move])
+        self.assertEqual(2, len(self.gameToAdd.key.get().moves))
+
+
+    def test_game_history_pages(self):
+        # 0.arrange
+        container = MAKE_MOVE_REQUEST.combined_message_class(
+            pos = 8,
+            urlsafe_game_key = self.gameToAdd.key.urlsafe())
+        self.api.make_move(container)
+        # 1.acion
+        history_request = GET_GAME_HISTORY_REQUEST.combined_message_class(
+            urlsafe_game_key = self.gameToAdd.key.urlsafe(),
+            page_size = 1)
+        first = self.api.get_game_history(history_request)
+        history_request.page_token = first.next_page_token
+        second = self.api.get_game_history(history_request)
+        # 2.assert
+        self.assertEqual(8, first.items[0].move)
+        self.assertEqual("O", second.items[0].player)
+        self.assertEqual(None, second.next_page_token)
+
+
+    def test_game_history_negative_page_token_exception(self):
+        # 0.arrange
+        history_request = GET_GAME_HISTORY_REQUEST.combined_message_class(
+            urlsafe_game_key = self.gameToAdd.key.urlsafe(),
+            page_token = "-3")
+        # 1.acion
+        # 2.assert
+        with self.assertRaises(endpoints.BadRequestException):
+            self.api.get_game_history(history_request)
+
+
+    def test_migrate_history(self):
+        # 0.arrange
+        History(game=self.gameToAdd.key, move=4, result="keep moving.",
+                datetime=datetime(2016, 1, 1, 0, 0, 0), player="X").put()
+        History(game=self.gameToAdd.key, move=2, result="keep moving.",
+                datetime=datetime(2016, 1, 1, 0, 0, 1), player="O").put()
+        # a move made after the deploy, before the migration ran
+        self.gameToAdd.add_move(0, "X", "keep moving.")
+        self.gameToAdd.put()
+        other = Game.new_game(self.user.key, "")
+        History(game=other.key, move=8, result="keep moving.",
+                datetime=datetime(2016, 1, 1, 0, 0, 2), player="X").put()
+        # 1.acion
+        cursor = History.migrate_batch(batch_size=1)
+        while cursor:
+            cursor = History.migrate_batch(cursor, batch_size=1)
+        # 2.assert
+        history_request = GET_GAME_HISTORY_REQUEST.combined_message_class(
+            urlsafe_game_key = self.gameToAdd.key.urlsafe())
+        game_histories = self.api.get_game_history(history_request)
+        self.assertEqual([4, 2, 0], [h.move for h in game_histories.items])
+        self.assertEqual(["X", "O", "X"],
+                         [h.player for h in game_histories.items])
+        self.assertEqual(1, len(other.key.get().moves))
+        self.assertEqual(0, History.query().count())
+
+
+    def test_migrate_history_one_batch(self):
+        # 0.arrange
+        other = Game.new_game(self.user.key, "")
+        for game in (self.gameToAdd, other):
+            History(game=game.key, move=4, result="keep moving.",
+                    datetime=datetime(2016, 1, 1, 0, 0, 0), player="X").put()
+        # 1.acion
+        cursor = History.migrate_batch(batch_size=1)
+        # 2.assert
+        self.assertTrue(cursor)
+        self.assertEqual(1, History.query().count())
+        self.assertEqual(1, len(self.gameToAdd.key.get().moves) +
+                            len(other.key.get().moves))
+
+
+    def test_migrate_history_retry_does_not_fold_twice(self):
+        # 0.arrange
+        keys = [History(game=self.gameToAdd.key, move=4,
+                        result="keep moving.", player="X",
+                        datetime=datetime(2016, 1, 1, 0, 0, 0)).put()]
+        History.fold(self.gameToAdd.key, keys)
+        # 1.acion
+        History.fold(self.gameToAdd.key, keys)
+        # 2.assert
+        self.assertEqual(1, len(self.gameToAdd.key.get().moves))
+
+
 
 
 
@@ -506,7 +1155,7 @@ class TicTacToeApiTestCase(unittest.TestCase):
     #         urlsafe_game_key = self.gameToAdd.key.urlsafe())
     #     game = self.api.make_move(container)
     #     # 1.acion
-    #     scores = self.api.get_scores(message_types.VoidMessage())
+    #     scores = self.api.get_scores(PAGE_REQUEST.combined_message_class())
     #     # 2.assert
     #     self.assertEqual(1, len(scores.items))
 
@@ -0,0 +1,91 @@
+import unittest
+import random
+
+import numpy as np
+
+import sys
+sys.path.append("..")
+from TicTacToe import batch, engine, solver
+
+
+def random_boards(count, seed=0):
+    """Returns packed boards of random games stopped after 0-9 moves"""
+    rng = random.Random(seed)
+    boards = []
+    for _ in range(count):
+        x = o = 0
+        for i in range(rng.randint(0, 9)):
+            pos = rng.choice(engine.free_cells(x, o))
+            if i % 2 == 0:
+                x = engine.place(x, pos)
+            else:
+                o = engine.place(o, pos)
+        boards.append(engine.pack(x, o))
+    return boards
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.packed = random_boards(500)
+        self.boards = batch.from_packed(self.packed)
+
+    def test_decoders_agree(self):
+        # 0.arrange
+        strings = [engine.to_string(*engine.unpack(board))
+                   for board in self.packed]
+        # 1.acion
+        decoded = batch.from_strings(strings)
+        # 2.assert
+        self.assertEqual((500, 9), decoded.shape)
+        self.assertTrue((decoded == self.boards).all())
+
+    def test_winners_match_engine(self):
+        # 1.acion
+        winners = batch.winners(self.boards)
+        # 2.assert
+        for board, winner in zip(self.packed, winners):
+            x, o = engine.unpack(board)
+            expected = (batch.X if engine.is_win(x) else
+                        batch.O if engine.is_win(o) else batch.EMPTY)
+            self.assertEqual(expected, winner)
+
+    def test_free_masks(self):
+        # 1.acion
+        free = batch.free_masks(self.boards)
+        # 2.assert
+        for board, mask in zip(self.packed, free):
+            x, o = engine.unpack(board)
+            self.assertEqual(engine.FULL & ~(x | o), mask)
+
+    def test_best_moves_and_values_match_solver(self):
+        # 1.acion
+        moves = batch.best_moves(self.boards)
+        values = batch.values(self.boards)
+        # 2.assert
+        for board, move, value in zip(self.packed, moves, values):
+            x, o = engine.unpack(board)
+            expected = solver.best_move(x, o)
+            self.assertEqual(-1 if expected is None else expected, move)
+            expected = solver.value(x, o)
+            self.assertEqual(batch.UNREACHABLE if expected is None
+                             else expected, value)
+
+    def test_move_logs_and_history(self):
+        # 0.arrange
+        log = b''.join(chr(pos | player << 4).encode('latin-1')
+                       for pos, player in ((4, 0), (0, 1), (8, 0)))
+        # 1.acion
+        from_log = batch.from_move_logs([log, b''])
+        ids, from_rows = batch.from_history(
+            [7, 7, 3, 7], [4, 0, 2, 8], ["X", "O", "X", "X"])
+        # 2.assert
+        expected = batch.from_strings(["O---X---X", "---------"])
+        self.assertTrue((expected == from_log).all())
+        self.assertEqual([3, 7], list(ids))
+        self.assertTrue((from_rows[1] == expected[0]).all())
+        self.assertEqual(batch.X, from_rows[0][2])
+
+
+if __name__=='__main__':
+    unittest.main()
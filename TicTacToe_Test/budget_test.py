@@ -0,0 +1,187 @@
+import unittest
+
+from datetime import date
+import time
+
+import import_app_engine
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from google.appengine.datastore import datastore_stub_util
+from protorpc import message_types
+
+
+import sys
+sys.path.append("..")
+from TicTacToe.api import *
+from TicTacToe.models import User, Game, Score
+from TicTacToe.cache import entity_cache
+from TicTacToe import leaderboard
+from TicTacToe import rpcstats
+
+
+# wall time ceiling of one call on the testbed stubs
+DEFAULT_SECONDS = 1.0
+
+
+class RpcBudgetTestCase(unittest.TestCase):
+    """Fails when an endpoint makes more datastore round trips than its
+    budget. Reads are Get calls, writes Put and Delete calls and queries
+    query batches, however many entities each one carries. Every check
+    prints the actual counts, so budgets can be tightened as they drop."""
+
+    def setUp(self):
+        self.api = TicTacToeApi()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=self.policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().clear_cache()
+        entity_cache.clear()
+        self.user = User.create("lisa", "abc@xyz")
+        # steady state: the leaderboard is built
+        leaderboard.rebuild([self.user])
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def assertWithinBudget(self, name, method, request, reads=0, writes=0,
+                           queries=0, seconds=DEFAULT_SECONDS):
+        """Calls method as a fresh request and asserts its round trips and
+        wall time are within budget. Returns the response."""
+        ndb.get_context().clear_cache()
+        with rpcstats.record(name) as stats:
+            started = time.time()
+            response = method(request)
+            elapsed = time.time() - started
+        actual = {'reads': stats.counts['get'],
+                  'writes': stats.counts['put'] + stats.counts['delete'],
+                  'queries': stats.counts['query']}
+        print('budget {}: reads {}/{} writes {}/{} queries {}/{} '
+              '{:.1f}/{:.0f}ms'.format(name, actual['reads'], reads,
+                                       actual['writes'], writes,
+                                       actual['queries'], queries,
+                                       elapsed * 1000, seconds * 1000))
+        self.assertLessEqual(actual['reads'], reads, name)
+        self.assertLessEqual(actual['writes'], writes, name)
+        self.assertLessEqual(actual['queries'], queries, name)
+        self.assertLessEqual(elapsed, seconds, name)
+        return response
+
+    def _new_game(self, board="---------", write_behind=False):
+        game = Game.new_game(self.user.key, "", write_behind=write_behind)
+        game.board = board
+        game.put()
+        return game.key.urlsafe()
+
+    def test_create_user_budget(self):
+        self.assertWithinBudget(
+            'create_user', self.api.create_user,
+            USER_REQUEST.combined_message_class(user_name="lulu",
+                                                email="amc@xyz"),
+            reads=1, writes=1, queries=1)
+
+    def test_new_game_budget(self):
+        self.assertWithinBudget(
+            'new_game', self.api.new_game,
+            NEW_GAME_REQUEST.combined_message_class(user_name="lisa"),
+            reads=1, writes=1)
+
+    def test_make_move_budget(self):
+        self.assertWithinBudget(
+            'make_move', self.api.make_move,
+            MAKE_MOVE_REQUEST.combined_message_class(
+                urlsafe_game_key=self._new_game(), pos=4),
+            reads=3, writes=1)
+
+    def test_make_move_ending_game_budget(self):
+        # the user and both counter shards are fetched in one call, and
+        # the game, score, user and shards written in one
+        form = self.assertWithinBudget(
+            'make_move (ends the game)', self.api.make_move,
+            MAKE_MOVE_REQUEST.combined_message_class(
+                urlsafe_game_key=self._new_game("XX-OO----"), pos=2),
+            reads=4, writes=1)
+        self.assertEqual(True, form.game_over)
+
+    def test_make_move_write_behind_budget(self):
+        self.assertWithinBudget(
+            'make_move (write_behind)', self.api.make_move,
+            MAKE_MOVE_REQUEST.combined_message_class(
+                urlsafe_game_key=self._new_game(write_behind=True), pos=4),
+            reads=2, writes=0)
+
+    def test_get_game_budget(self):
+        request = GET_GAME_REQUEST.combined_message_class(
+            urlsafe_game_key=self._new_game())
+        self.assertWithinBudget('get_game (cold)', self.api.get_game,
+                                request, reads=2)
+        self.assertWithinBudget('get_game (cached)', self.api.get_game,
+                                request, reads=1)
+
+    def test_get_game_history_budget(self):
+        self.assertWithinBudget(
+            'get_game_history', self.api.get_game_history,
+            GET_GAME_HISTORY_REQUEST.combined_message_class(
+                urlsafe_game_key=self._new_game()),
+            reads=1)
+
+    def test_cancel_game_budget(self):
+        self.assertWithinBudget(
+            'cancel_game', self.api.cancel_game,
+            CANCEL_GAME_REQUEST.combined_message_class(
+                urlsafe_game_key=self._new_game()),
+            reads=1, writes=1)
+
+    def test_get_user_games_budget_for_any_n(self):
+        # a page with a successor takes one more query batch to find it
+        for count in (1, 20, 50):
+            ndb.put_multi([Game(user=self.user.key, board="---------",
+                                message="keep moving.")
+                           for _ in range(count)])
+            self.assertWithinBudget(
+                'get_user_games ({} games)'.format(count),
+                self.api.get_user_games,
+                USER_REQUEST.combined_message_class(user_name="lisa"),
+                reads=1, queries=2)
+
+    def test_get_user_scores_budget_for_any_n(self):
+        for count in (1, 20, 50):
+            ndb.put_multi([Score(user=self.user.key, date=date.today(),
+                                 winner="X", point=1)
+                           for _ in range(count)])
+            self.assertWithinBudget(
+                'get_user_scores ({} scores)'.format(count),
+                self.api.get_user_scores,
+                USER_REQUEST.combined_message_class(user_name="lisa"),
+                reads=1, queries=2)
+
+    def test_get_scores_budget_for_any_n(self):
+        users = [User.create("user{}".format(i), None) for i in range(50)]
+        for count in (1, 20, 50):
+            ndb.put_multi([Score(user=user.key, date=date.today(),
+                                 winner="X", point=1)
+                           for user in users[:count]])
+            self.assertWithinBudget(
+                'get_scores ({} users)'.format(count), self.api.get_scores,
+                PAGE_REQUEST.combined_message_class(),
+                reads=1, queries=2)
+
+    def test_get_user_rankings_budget(self):
+        self.assertWithinBudget(
+            'get_user_rankings', self.api.get_user_rankings,
+            RANKINGS_REQUEST.combined_message_class(user_name="lisa",
+                                                    window=5),
+            reads=1)
+
+    def test_get_average_win_rates_budget(self):
+        # at most one get of the shards of each counter
+        self.assertWithinBudget(
+            'get_average_win_rates', self.api.get_average_win_rates,
+            message_types.VoidMessage(), reads=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
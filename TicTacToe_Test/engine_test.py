@@ -0,0 +1,78 @@
+import unittest
+
+import sys
+sys.path.append("..")
+from TicTacToe import engine
+
+
+class EngineTestCase(unittest.TestCase):
+
+    def test_string_round_trip(self):
+        x, o = engine.from_string("XO-X-O--X")
+        self.assertEqual("XO-X-O--X", engine.to_string(x, o))
+
+    def test_pack_round_trip(self):
+        x, o = engine.from_string("XO-X-O--X")
+        self.assertEqual((x, o), engine.unpack(engine.pack(x, o)))
+        self.assertEqual(0, engine.pack(0, 0))
+
+    def test_canonical_is_shared_by_symmetric_boards(self):
+        x, o = engine.from_string("X---O---O")
+        key, _ = engine.canonical(x, o)
+        for t in range(8):
+            tx, to = engine.TRANSFORMS[t][x], engine.TRANSFORMS[t][o]
+            self.assertEqual(key, engine.canonical(tx, to)[0])
+
+    def test_from_canonical_maps_moves_back(self):
+        x, o = engine.from_string("-X--O----")
+        key, t = engine.canonical(x, o)
+        cx, co = engine.unpack(key)
+        for pos in range(engine.CELLS):
+            self.assertEqual(bool(cx & 1 << pos),
+                             bool(x & 1 << engine.from_canonical(pos, t)))
+
+    def test_every_line_wins(self):
+        for line in engine.LINES:
+            self.assertTrue(engine.is_win(line))
+
+    def test_two_in_a_row_does_not_win(self):
+        x, o = engine.from_string("XX-OO----")
+        self.assertFalse(engine.is_win(x))
+        self.assertFalse(engine.is_win(o))
+
+    def test_free_cells(self):
+        x, o = engine.from_string("XXOOXXOO-")
+        self.assertEqual((8,), engine.free_cells(x, o))
+        self.assertFalse(engine.is_full(x, o))
+        self.assertTrue(engine.is_full(engine.place(x, 8), o))
+
+    def test_is_free(self):
+        x, o = engine.from_string("--O-X----")
+        self.assertFalse(engine.is_free(x, o, 2))
+        self.assertFalse(engine.is_free(x, o, 4))
+        self.assertTrue(engine.is_free(x, o, 0))
+
+    def test_wins_at_walks_the_lines_through_pos(self):
+        diagonal = sum(1 << (r * 15 + r) for r in range(3, 8))
+        self.assertTrue(engine.wins_at(diagonal, 5 * 15 + 5, 15, 5))
+        self.assertFalse(engine.wins_at(diagonal & ~(1 << 3 * 15 + 3),
+                                        5 * 15 + 5, 15, 5))
+        anti = sum(1 << (r * 15 + 14 - r) for r in range(5))
+        self.assertTrue(engine.wins_at(anti, 14, 15, 5))
+
+    def test_wins_at_does_not_wrap_rows(self):
+        # cells 13-14 end row 0 and cells 15-17 start row 1
+        mask = sum(1 << pos for pos in range(13, 18))
+        self.assertFalse(engine.wins_at(mask, 15, 15, 5))
+        self.assertFalse(engine.has_line(mask, 15, 5))
+
+    def test_large_board_round_trip(self):
+        x, o = 1 << 224, 1 << 112
+        board = engine.pack(x, o, 15)
+        self.assertEqual((x, o), engine.unpack(board, 15))
+        self.assertEqual(223, len(engine.free_cells(x, o, 15)))
+        self.assertEqual("O", engine.to_string(x, o, 15)[112])
+
+
+if __name__=='__main__':
+    unittest.main()
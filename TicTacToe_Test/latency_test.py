@@ -0,0 +1,82 @@
+import unittest
+
+import import_app_engine
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from google.appengine.datastore import datastore_stub_util
+
+
+import sys
+sys.path.append("..")
+from TicTacToe.api import *
+from TicTacToe.models import User
+from TicTacToe.cache import entity_cache
+from TicTacToe import main
+from TicTacToe import latency
+
+
+class LatencyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.api = TicTacToeApi()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=self.policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().clear_cache()
+        entity_cache.clear()
+        # drop what earlier tests left in this instance's histograms
+        latency.flush()
+        latency.reset(TicTacToeApi.all_remote_methods())
+        User.create("lisa", "abc@xyz")
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_percentile_reads_bucket_bounds(self):
+        # 0.arrange
+        bounds = (1, 2, 4, 8)
+        counts = [0] * (len(bounds) + 1)
+        for value in [0.5] * 50 + [3] * 45 + [7] * 4 + [100]:
+            counts[latency.bucket(bounds, value)] += 1
+        # 1.acion
+        result = [latency.percentile(bounds, counts, p)
+                  for p in latency.PERCENTILES]
+        # 2.assert
+        self.assertEqual([1, 4, 8], result)
+        self.assertEqual(None, latency.percentile(bounds, [0] * 5, 50))
+
+    def test_timed_endpoint_is_reported_after_flush(self):
+        # 0.arrange
+        container = NEW_GAME_REQUEST.combined_message_class(user_name="lisa")
+        # 1.acion
+        for _ in range(latency.SIZE_SAMPLE_EVERY):
+            self.api.new_game(container)
+        latency.flush()
+        # 2.assert
+        report = latency.report(['new_game'])['new_game']
+        self.assertEqual(latency.SIZE_SAMPLE_EVERY, report['wall_ms']['count'])
+        self.assertEqual(latency.SIZE_SAMPLE_EVERY, report['cpu_ms']['count'])
+        self.assertEqual(1, report['bytes']['count'])
+        self.assertTrue(report['wall_ms']['p50'] <= report['wall_ms']['p99'])
+
+    def test_admin_handler_reports_percentiles(self):
+        # 0.arrange
+        self.api.new_game(NEW_GAME_REQUEST.combined_message_class(
+            user_name="lisa"))
+        # 1.acion
+        response = main.webapp2.Request.blank(
+            '/admin/latency?reset=1').get_response(main.app)
+        # 2.assert
+        self.assertEqual(200, response.status_int)
+        self.assertIn('new_game', response.body)
+        self.assertIn('p99', response.body)
+        self.assertEqual(0, latency.report(
+            ['new_game'])['new_game']['wall_ms']['count'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,249 @@
+"""load_benchmark.py - Load generator and throughput benchmark for
+TicTacToeApi.
+
+Simulated players create their users, start games and play them to the end
+against the testbed stubs, interleaved in a seeded random order, so the run
+is offline and repeatable. While a player has a game in progress each step
+is drawn from the --mix weights; a player without one starts a new game until
+it has played --games of them. Every endpoint call is timed and the RPCs it
+makes are counted per service. The report gives requests per second, the
+latency percentiles of each endpoint and its RPCs per call, and is written
+as JSON to --output so runs can be compared across changes:
+    python load_benchmark.py --players 100 --games 5 --output before.json"""
+
+import argparse
+import json
+import math
+import random
+import subprocess
+import time
+from collections import defaultdict
+
+import import_app_engine
+import endpoints
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from google.appengine.datastore import datastore_stub_util
+
+
+import sys
+sys.path.append("..")
+from TicTacToe.api import *
+from TicTacToe.models import Difficulty
+
+
+DEFAULT_MIX = ('make_move=70,get_game=15,get_game_history=5,'
+               'get_user_games=5,get_user_rankings=5')
+DEFAULT_DIFFICULTY = 'EASY=1,MEDIUM=1,PERFECT=1'
+PERCENTILES = (50, 95, 99)
+
+
+def weights(spec):
+    """Returns [(name, weight)] for a 'name=weight,...' spec"""
+    pairs = [item.split('=') for item in spec.split(',') if item]
+    return [(name.strip(), float(weight)) for name, weight in pairs]
+
+
+def choose(rng, weighted):
+    """Returns a name from [(name, weight)] with probability by weight"""
+    point = rng.uniform(0, sum(weight for _, weight in weighted))
+    for name, weight in weighted:
+        point -= weight
+        if point <= 0:
+            return name
+    return weighted[-1][0]
+
+
+def percentile(values, p):
+    """Returns the nearest-rank p-th percentile of values"""
+    values = sorted(values)
+    if not values:
+        return None
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+class Recorder(object):
+    """Times endpoint calls and counts the RPCs each one makes by service"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.rpcs = defaultdict(lambda: defaultdict(int))
+        self.errors = defaultdict(int)
+        self._current = None
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'load_benchmark', self._count)
+
+    def _count(self, service, call, request, response):
+        if self._current is not None:
+            self.rpcs[self._current][service] += 1
+
+    def call(self, name, method, request):
+        """Calls an endpoint method as a fresh request would. Returns its
+        response, or None if it raised an endpoints error."""
+        # every request starts with an empty ndb context cache
+        ndb.get_context().clear_cache()
+        self._current = name
+        started = time.time()
+        try:
+            return method(request)
+        except endpoints.ServiceException:
+            self.errors[name] += 1
+        finally:
+            self.latencies[name].append(time.time() - started)
+            self._current = None
+
+    def report(self):
+        """Returns {endpoint: stats} for every endpoint called"""
+        result = {}
+        for name, latencies in self.latencies.items():
+            stats = {'calls': len(latencies),
+                     'errors': self.errors[name],
+                     'mean_ms': 1000 * sum(latencies) / len(latencies)}
+            for p in PERCENTILES:
+                stats['p{}_ms'.format(p)] = 1000 * percentile(latencies, p)
+            stats['rpcs_per_call'] = dict(
+                (service, float(count) / len(latencies))
+                for service, count in self.rpcs[name].items())
+            result[name] = stats
+        return result
+
+
+class Player(object):
+    """A simulated player working through its games"""
+
+    def __init__(self, name, games, write_behind):
+        self.name = name
+        self.games_left = games
+        self.write_behind = write_behind
+        self.game = None
+
+    def step(self, api, recorder, rng, mix, difficulty):
+        """Makes one request"""
+        if self.game is None:
+            self.game = recorder.call(
+                'new_game', api.new_game,
+                NEW_GAME_REQUEST.combined_message_class(
+                    user_name=self.name,
+                    difficulty=Difficulty(choose(rng, difficulty)),
+                    write_behind=self.write_behind))
+            return
+        action = choose(rng, mix)
+        key = self.game.urlsafe_key
+        if action == 'make_move':
+            free = [i for i, cell in enumerate(self.game.board) if cell == '-']
+            form = recorder.call(
+                action, api.make_move,
+                MAKE_MOVE_REQUEST.combined_message_class(
+                    urlsafe_game_key=key, pos=rng.choice(free)))
+            if form:
+                self.game = form
+                if form.game_over:
+                    self.game = None
+                    self.games_left -= 1
+        elif action == 'get_game':
+            recorder.call(action, api.get_game,
+                          GET_GAME_REQUEST.combined_message_class(
+                              urlsafe_game_key=key))
+        elif action == 'get_game_history':
+            recorder.call(action, api.get_game_history,
+                          GET_GAME_HISTORY_REQUEST.combined_message_class(
+                              urlsafe_game_key=key))
+        elif action == 'get_user_games':
+            recorder.call(action, api.get_user_games,
+                          USER_REQUEST.combined_message_class(
+                              user_name=self.name))
+        elif action == 'get_user_rankings':
+            recorder.call(action, api.get_user_rankings,
+                          RANKINGS_REQUEST.combined_message_class(
+                              user_name=self.name, window=5))
+        else:
+            raise ValueError('unknown action: ' + action)
+
+
+def revision():
+    """Returns the git revision being measured, or None outside a checkout"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(players=50, games=3, mix=DEFAULT_MIX, difficulty=DEFAULT_DIFFICULTY,
+        write_behind=0.0, seed=0):
+    """Runs the load and returns the result dict"""
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub()
+    try:
+        rng = random.Random(seed)
+        # the robot's EASY moves use the module level generator
+        random.seed(seed)
+        api = TicTacToeApi()
+        recorder = Recorder()
+        started = time.time()
+        crowd = [Player('player{}'.format(i), games,
+                        rng.random() < write_behind)
+                 for i in range(players)]
+        for player in crowd:
+            recorder.call('create_user', api.create_user,
+                          USER_REQUEST.combined_message_class(
+                              user_name=player.name,
+                              email=player.name + '@xyz'))
+        active = list(crowd)
+        while active:
+            player = rng.choice(active)
+            player.step(api, recorder, rng, weights(mix), weights(difficulty))
+            if not player.games_left:
+                active.remove(player)
+        elapsed = time.time() - started
+    finally:
+        bed.deactivate()
+    endpoint_stats = recorder.report()
+    requests = sum(stats['calls'] for stats in endpoint_stats.values())
+    return {'revision': revision(),
+            'config': {'players': players, 'games': games, 'mix': mix,
+                       'difficulty': difficulty,
+                       'write_behind': write_behind, 'seed': seed},
+            'requests': requests,
+            'seconds': elapsed,
+            'requests_per_second': requests / elapsed,
+            'endpoints': endpoint_stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--players', type=int, default=50)
+    parser.add_argument('--games', type=int, default=3,
+                        help='games each player plays to the end')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='weights of the requests made mid-game')
+    parser.add_argument('--difficulty', default=DEFAULT_DIFFICULTY,
+                        help='weights of the difficulty of new games')
+    parser.add_argument('--write-behind', type=float, default=0.0,
+                        help='fraction of players using write_behind games')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='load_benchmark.json')
+    args = parser.parse_args()
+    result = run(args.players, args.games, args.mix, args.difficulty,
+                 args.write_behind, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+    print('{requests} requests in {seconds:.2f}s, '
+          '{requests_per_second:.1f} requests/s'.format(**result))
+    for name, stats in sorted(result['endpoints'].items()):
+        print('  {:<18} {:>6} calls  p50 {:7.2f}ms  p95 {:7.2f}ms  '
+              'p99 {:7.2f}ms  datastore {:5.2f}/call'.format(
+                  name, stats['calls'], stats['p50_ms'], stats['p95_ms'],
+                  stats['p99_ms'],
+                  stats['rpcs_per_call'].get('datastore_v3', 0)))
+    print('wrote ' + args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+import unittest
+
+import os
+import time
+
+import import_app_engine
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from google.appengine.datastore import datastore_stub_util
+
+
+import sys
+sys.path.append("..")
+from TicTacToe import main
+from TicTacToe.models import User, Game
+from TicTacToe.cache import entity_cache
+
+
+# cron and task requests are cut off after 10 minutes
+DEADLINE_SECONDS = 600
+# set REMINDER_TEST_USERS to run the fan-out test against fewer users
+REMINDER_TEST_USERS = int(os.environ.get('REMINDER_TEST_USERS', 100000))
+
+
+class SendReminderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=self.policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_mail_stub()
+        self.testbed.init_taskqueue_stub()
+        self.mail_stub = self.testbed.get_stub(testbed.MAIL_SERVICE_NAME)
+        self.taskqueue_stub = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        ndb.get_context().clear_cache()
+        entity_cache.clear()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def _add_users(self, count, email=True, game_over=False):
+        for start in range(0, count, 500):
+            names = ["user{}-{}-{}".format(i, email, game_over)
+                     for i in range(start, min(start + 500, count))]
+            users = [User(key=User.key_for(name), name=name,
+                          email=name + "@xyz" if email else None,
+                          wins=0, total=0, rate=0) for name in names]
+            ndb.put_multi(users)
+            # two open games for each user, to check users are mailed once
+            ndb.put_multi([Game(user=user.key, board="---------",
+                                game_over=game_over)
+                           for user in users for _ in range(2)])
+
+    def _request(self, url, method='GET', body=None):
+        request = main.webapp2.Request.blank(url)
+        request.method = method
+        if body is not None:
+            request.body = body
+            request.content_type = 'application/x-www-form-urlencoded'
+        started = time.time()
+        response = request.get_response(main.app)
+        return response, time.time() - started
+
+    def _run_tasks(self):
+        """Runs queued tasks until the queue is empty and returns the
+        slowest request time"""
+        slowest = 0
+        while True:
+            tasks = self.taskqueue_stub.get_filtered_tasks()
+            if not tasks:
+                return slowest
+            self.taskqueue_stub.FlushQueue('default')
+            for task in tasks:
+                response, elapsed = self._request(task.url, 'POST',
+                                                  task.payload)
+                self.assertEqual(204, response.status_int)
+                slowest = max(slowest, elapsed)
+
+    def test_send_reminder_mails_each_user_once(self):
+        # 0.arrange
+        self._add_users(250)
+        self._add_users(30, email=False)
+        self._add_users(20, game_over=True)
+        # 1.acion
+        self._request('/crons/send_reminder')
+        self._run_tasks()
+        # 2.assert
+        sent = self.mail_stub.get_sent_messages()
+        self.assertEqual(250, len(sent))
+        self.assertEqual(250, len(set(message.to for message in sent)))
+
+    def test_send_reminder_shard_chain_is_idempotent(self):
+        # 0.arrange
+        self._add_users(main.REMINDER_SHARD_SIZE + 1)
+        # 1.acion
+        self._request('/crons/send_reminder')
+        first = self.taskqueue_stub.get_filtered_tasks()[0]
+        self._request(first.url, 'POST', first.payload)
+        # a retry of the first shard must not queue its successor twice
+        self._request(first.url, 'POST', first.payload)
+        # 2.assert
+        shards = self.taskqueue_stub.get_filtered_tasks(
+            url=main.REMINDER_SHARD_URL)
+        self.assertEqual(2, len(shards))
+
+    def test_send_reminder_fan_out_within_deadline(self):
+        # 0.arrange
+        self._add_users(REMINDER_TEST_USERS)
+        # 1.acion
+        response, cron_elapsed = self._request('/crons/send_reminder')
+        started = time.time()
+        slowest = self._run_tasks()
+        # 2.assert
+        self.assertEqual(200, response.status_int)
+        self.assertLess(cron_elapsed, DEADLINE_SECONDS)
+        self.assertLess(slowest, DEADLINE_SECONDS)
+        self.assertLess(time.time() - started, DEADLINE_SECONDS)
+        self.assertEqual(REMINDER_TEST_USERS,
+                         len(self.mail_stub.get_sent_messages()))
+
+    def test_checkpoint_games_queues_only_dirty_shards(self):
+        # 0.arrange
+        game = Game(user=User.key_for('user'), board="---------")
+        game.put()
+        main.hotstore._mark_dirty(game.key)
+        # 1.acion
+        response, _ = self._request('/crons/checkpoint_games')
+        # 2.assert
+        self.assertEqual(200, response.status_int)
+        tasks = self.taskqueue_stub.get_filtered_tasks(
+            url=main.CHECKPOINT_SHARD_URL)
+        self.assertEqual(1, len(tasks))
+        self.assertIn('shard={}'.format(
+            main.hotstore.dirty_shard(game.key)), tasks[0].payload)
+
+    def test_checkpoint_games_skips_clean_shards(self):
+        # 1.acion
+        response, _ = self._request('/crons/checkpoint_games')
+        # 2.assert
+        self.assertEqual(200, response.status_int)
+        self.assertEqual([], self.taskqueue_stub.get_filtered_tasks())
+
+
+if __name__ == '__main__':
+    unittest.main()
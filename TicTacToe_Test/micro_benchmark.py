@@ -0,0 +1,191 @@
+"""micro_benchmark.py - Micro-benchmarks of the per-move hot paths.
+
+Times the engine and robot work done on every move, and the message
+construction and protorpc encoding of the endpoint responses, in plain
+Python: no endpoints server or datastore is involved. Each benchmark reports
+nanoseconds per operation and the objects per operation left for the cyclic
+garbage collector, counted with the collector disabled; CPython 2.7 has no
+counter of every allocation, so this catches garbage and leaks rather than
+short-lived temporaries. Under Python 3 the peak traced bytes per operation
+are reported as well.
+
+The message benchmarks need the App Engine SDK on the path, as the tests do,
+and are skipped without it. Save a run and check later ones against it:
+    python micro_benchmark.py --output baseline.json
+    python micro_benchmark.py --baseline baseline.json --tolerance 0.2
+The second run exits non-zero if any benchmark got slower than the baseline
+by more than the tolerance."""
+
+import argparse
+import gc
+import json
+import random
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import sys
+sys.path.append("..")
+from TicTacToe import engine, robot, solver
+
+
+# seconds each timing run is calibrated to last
+TARGET_SECONDS = 0.2
+REPEATS = 3
+ENCODE_SIZES = (10, 100, 10000)
+
+# mid-game boards with the robot, O, to move; one engine or robot op covers
+# all of them
+BOARDS = ("X--------", "----X----", "X---O---X", "-X--O--X-", "XOX-O---X")
+
+
+def measure(function, target=TARGET_SECONDS, repeats=REPEATS):
+    """Returns (ns/op, gc objects/op, peak bytes/op or None) for function"""
+    number = 1
+    while True:
+        elapsed = timeit.timeit(function, number=number)
+        if elapsed >= target / 10 or number >= 1 << 24:
+            break
+        number *= 10
+    number = max(int(number * target / max(elapsed, 1e-9)), 1)
+    best = min(timeit.repeat(function, number=number, repeat=repeats))
+
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.get_count()[0]
+        for _ in range(number):
+            function()
+        objects = float(gc.get_count()[0] - before) / number
+    finally:
+        if enabled:
+            gc.enable()
+        gc.collect()
+
+    peak = None
+    if tracemalloc:
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return best * 1e9 / number, objects, peak
+
+
+def engine_benchmarks():
+    """Returns [(name, function)] for the engine and robot hot paths"""
+    masks = [engine.from_string(board) for board in BOARDS]
+    rng = random.Random(0)
+    solver.get_book()
+    benchmarks = [
+        ('engine.from_string', lambda: [engine.from_string(board)
+                                        for board in BOARDS]),
+        ('engine.to_string', lambda: [engine.to_string(x, o)
+                                      for x, o in masks]),
+        ('engine.is_win', lambda: [engine.is_win(x) for x, o in masks]),
+        ('engine.free_cells', lambda: [engine.free_cells(x, o)
+                                       for x, o in masks]),
+    ]
+    for level in robot.LEVELS:
+        benchmarks.append((
+            'robot.choose_move[{}]'.format(level),
+            lambda level=level: [robot.choose_move(level, x, o, "O", rng)
+                                 for x, o in masks]))
+    return benchmarks
+
+
+def message_benchmarks():
+    """Returns [(name, function)] for building and encoding the endpoint
+    messages. Needs the App Engine SDK."""
+    from datetime import date
+    import import_app_engine
+    from google.appengine.ext import ndb
+    from protorpc import protojson
+    from TicTacToe.api import TicTacToeApi
+    from TicTacToe.models import Game, Score, GameForms, ScoreForms
+
+    api = TicTacToeApi()
+    user = ndb.Key('User', 'lisa', app='bench')
+    game = Game(key=ndb.Key('Game', 1, app='bench'), user=user,
+                board="XO--X---O", message="Keep moving.", game_over=False)
+    for pos, player in ((0, "X"), (4, "O"), (1, "X"), (8, "O")):
+        game.add_move(pos, player, "keep moving.")
+    score = Score(user=user, date=date(2016, 1, 1), winner="X", point=1)
+
+    benchmarks = [
+        ('TicTacToeApi.get_winner', lambda: [api.get_winner(board, "X")
+                                             for board in BOARDS]),
+        ('Game.to_form', lambda: game.to_form("lisa")),
+        ('Game.history_forms', lambda: game.history_forms(20)),
+        ('Score.to_form', lambda: score.to_form("lisa")),
+    ]
+    for size in ENCODE_SIZES:
+        games = GameForms(items=[game.to_form("lisa")] * size)
+        scores = ScoreForms(items=[score.to_form("lisa")] * size)
+        benchmarks.append((
+            'encode GameForms[{}]'.format(size),
+            lambda games=games: protojson.encode_message(games)))
+        benchmarks.append((
+            'encode ScoreForms[{}]'.format(size),
+            lambda scores=scores: protojson.encode_message(scores)))
+    return benchmarks
+
+
+def run(pattern=None):
+    """Returns {name: result} for the benchmarks whose name contains
+    pattern"""
+    benchmarks = engine_benchmarks()
+    try:
+        benchmarks += message_benchmarks()
+    except ImportError as e:
+        print('skipping message benchmarks: {}'.format(e))
+    results = {}
+    for name, function in benchmarks:
+        if pattern and pattern not in name:
+            continue
+        ns, objects, peak = measure(function)
+        results[name] = {'ns_per_op': ns, 'gc_objects_per_op': objects,
+                         'peak_bytes_per_op': peak}
+        print('{:<28} {:>14.0f} ns/op {:>8.2f} gc objs/op{}'.format(
+            name, ns, objects,
+            '' if peak is None else ' {:>10d} peak B/op'.format(peak)))
+    return results
+
+
+def regressions(results, baseline, tolerance):
+    """Returns the names of the benchmarks slower than baseline by more
+    than tolerance"""
+    return sorted(name for name, result in results.items()
+                  if name in baseline and result['ns_per_op'] >
+                  baseline[name]['ns_per_op'] * (1 + tolerance))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('pattern', nargs='?',
+                        help='only run benchmarks whose name contains it')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+    results = run(args.pattern)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for name in slower:
+            print('regression: ' + name)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import unittest
+import random
+import os
+import tempfile
+
+import sys
+sys.path.append("..")
+from TicTacToe import engine, robot, solver
+
+
+class RobotTestCase(unittest.TestCase):
+
+    def test_solve_reaches_every_position(self):
+        # the 5478 reachable positions fall into 765 symmetry classes
+        records = solver.solve()
+        self.assertEqual(solver.POSITIONS, len(records))
+
+    def test_symmetric_positions_share_a_record(self):
+        x, o = engine.from_string("X---O----")
+        for t in range(8):
+            tx, to = engine.TRANSFORMS[t][x], engine.TRANSFORMS[t][o]
+            self.assertEqual(solver.value(x, o), solver.value(tx, to))
+            move = solver.best_move(tx, to)
+            self.assertTrue(engine.is_free(tx, to, move))
+            # X is to move
+            self.assertEqual(solver.value(x, o), -solver.value(
+                engine.place(tx, move), to))
+
+    def test_unreachable_position_has_no_record(self):
+        x, o = engine.from_string("XXX------")
+        self.assertEqual(None, solver.value(x, o))
+        self.assertEqual(None, solver.best_move(x, o))
+
+    def test_shipped_book_is_current(self):
+        with open(solver.BOOK_PATH, 'rb') as f:
+            self.assertEqual(solver.pack(solver.solve()), f.read())
+
+    def test_corrupt_book_is_rejected(self):
+        data = bytearray(solver.pack(solver.solve()))
+        data[-1] ^= 0xff
+        with self.assertRaises(solver.BookError):
+            solver.verify(bytes(data))
+
+    def test_fastest_win(self):
+        x, o = engine.from_string("XX-OO-X--")
+        self.assertEqual(1, solver.depth(x, o))
+
+    def test_empty_board_is_a_draw(self):
+        self.assertEqual(0, solver.value(0, 0))
+
+    def test_perfect_takes_the_win(self):
+        x, o = engine.from_string("XX-OO-X--")
+        self.assertEqual(5, robot.choose_move(robot.PERFECT, x, o, "O"))
+
+    def test_medium_blocks(self):
+        x, o = engine.from_string("XX--O----")
+        self.assertEqual(2, robot.choose_move(robot.MEDIUM, x, o, "O"))
+
+    def test_perfect_never_loses_to_random(self):
+        rng = random.Random(7)
+        for _ in range(200):
+            x = o = 0
+            while not engine.is_win(x) and not engine.is_full(x, o):
+                x = engine.place(x, rng.choice(engine.free_cells(x, o)))
+                if engine.is_win(x) or engine.is_full(x, o):
+                    break
+                o = engine.place(o, robot.choose_move(robot.PERFECT, x, o, "O"))
+                if engine.is_win(o):
+                    break
+            self.assertFalse(engine.is_win(x))
+
+    def test_missing_book_is_rebuilt(self):
+        path = os.path.join(tempfile.mkdtemp(), 'book.bin')
+        with self.assertRaises(solver.BookError):
+            solver.load_book(path)
+        solver._rebuild(path)
+        self.assertEqual('file', solver.load_book(path).source)
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""rpc_timeline.py - Prints the RPC timeline of new_game and make_move.
+
+Runs the endpoints against the testbed stubs and records when each
+datastore, memcache and taskqueue RPC is issued and when its result is
+collected. An RPC issued before the ones ahead of it have completed overlaps
+them; the number of sequential steps is the critical path of the request.
+Run it on two revisions to compare them:
+    python rpc_timeline.py"""
+
+import time
+
+import import_app_engine
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from google.appengine.datastore import datastore_stub_util
+
+
+import sys
+sys.path.append("..")
+from TicTacToe.api import *
+from TicTacToe.models import User, Game, Difficulty
+from TicTacToe.cache import entity_cache
+
+
+class Timeline(object):
+    """Collects (name, issued, completed) for each RPC made while active"""
+
+    def __init__(self):
+        self.started = None
+        self.rpcs = []
+        self._issued = {}
+
+    def _pre(self, service, call, request, response, rpc):
+        if self.started is not None:
+            self._issued[id(rpc)] = time.time()
+
+    def _post(self, service, call, request, response, rpc):
+        issued = self._issued.pop(id(rpc), None)
+        if issued is not None:
+            self.rpcs.append(('{}.{}'.format(service, call),
+                              issued - self.started,
+                              time.time() - self.started))
+
+    def install(self):
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'rpc_timeline', self._pre)
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'rpc_timeline', self._post)
+
+    def record(self, function, *args):
+        """Calls function with args from cold caches and returns the
+        recorded RPCs sorted by issue time"""
+        ndb.get_context().clear_cache()
+        entity_cache.clear()
+        self.rpcs, self._issued = [], {}
+        self.started = time.time()
+        try:
+            function(*args)
+        finally:
+            self.started = None
+        return sorted(self.rpcs, key=lambda rpc: rpc[1])
+
+
+def steps(rpcs):
+    """Returns the number of sequential steps: an RPC issued after every
+    earlier RPC has completed starts a new step"""
+    count, completed = 0, None
+    for _, issued, done in rpcs:
+        if completed is None or issued >= completed:
+            count += 1
+            completed = done
+        else:
+            completed = max(completed, done)
+    return count
+
+
+def report(title, rpcs):
+    print('{}: {} RPCs in {} sequential steps'.format(title, len(rpcs),
+                                                      steps(rpcs)))
+    for name, issued, done in rpcs:
+        print('  {:8.2f}ms {:8.2f}ms  {}'.format(issued * 1000,
+                                                (done - issued) * 1000, name))
+
+
+def main():
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1))
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub()
+    try:
+        api = TicTacToeApi()
+        User.create("lisa", "abc@xyz")
+        timeline = Timeline()
+        timeline.install()
+
+        report('new_game', timeline.record(
+            api.new_game, NEW_GAME_REQUEST.combined_message_class(
+                user_name="lisa", difficulty=Difficulty.PERFECT)))
+
+        game = Game.new_game(User.key_for("lisa"), "")
+        report('make_move', timeline.record(
+            api.make_move, MAKE_MOVE_REQUEST.combined_message_class(
+                urlsafe_game_key=game.key.urlsafe(), pos=4)))
+
+        # the winning move also ends the game
+        game = Game.new_game(User.key_for("lisa"), "")
+        game.board = "XX-OO----"
+        game.put()
+        report('make_move (ends the game)', timeline.record(
+            api.make_move, MAKE_MOVE_REQUEST.combined_message_class(
+                urlsafe_game_key=game.key.urlsafe(), pos=2)))
+
+        game = Game.new_game(User.key_for("lisa"), "", write_behind=True)
+        report('make_move (write_behind)', timeline.record(
+            api.make_move, MAKE_MOVE_REQUEST.combined_message_class(
+                urlsafe_game_key=game.key.urlsafe(), pos=4)))
+
+        game = Game.new_game(User.key_for("lisa"), "", write_behind=True)
+        game.board = "XX-OO----"
+        game.put()
+        report('make_move (write_behind, ends the game)', timeline.record(
+            api.make_move, MAKE_MOVE_REQUEST.combined_message_class(
+                urlsafe_game_key=game.key.urlsafe(), pos=2)))
+    finally:
+        bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
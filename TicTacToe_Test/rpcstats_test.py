@@ -0,0 +1,93 @@
+import unittest
+
+import import_app_engine
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from google.appengine.datastore import datastore_stub_util
+
+
+import sys
+sys.path.append("..")
+from TicTacToe.api import *
+from TicTacToe.models import User, Game
+from TicTacToe.cache import entity_cache
+from TicTacToe import main
+from TicTacToe import rpcstats
+
+
+class RpcStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.api = TicTacToeApi()
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=self.policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub()
+        ndb.get_context().clear_cache()
+        entity_cache.clear()
+        # drop what earlier tests left in this instance's totals
+        rpcstats.flush()
+        rpcstats.reset(TicTacToeApi.all_remote_methods())
+        self.user = User.create("lisa", "abc@xyz")
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def test_record_counts_by_kind(self):
+        # 0.arrange
+        keys = [User.create("user{}".format(i), None).key for i in range(3)]
+        # 1.acion
+        with rpcstats.record("test") as stats:
+            ndb.get_multi(keys, use_cache=False, use_memcache=False)
+            Game(user=self.user.key, board="---------").put()
+            Game.query(Game.user == self.user.key).fetch()
+        # 2.assert
+        self.assertEqual(1, stats.counts['get'])
+        self.assertEqual({'User': 1}, dict(stats.gets_by_kind))
+        self.assertEqual({'User': 3}, dict(stats.keys_by_kind))
+        self.assertEqual({'Game': 1}, dict(stats.puts_by_kind))
+        self.assertEqual({'Game': 1}, dict(stats.queries_by_kind))
+        self.assertEqual([], stats.n_plus_one())
+
+    def test_record_flags_n_plus_one(self):
+        # 0.arrange
+        keys = [User.create("user{}".format(i), None).key
+                for i in range(rpcstats.N_PLUS_ONE_GETS + 1)]
+        # 1.acion
+        with rpcstats.record("test") as stats:
+            for key in keys:
+                key.get(use_cache=False, use_memcache=False)
+        # 2.assert
+        self.assertEqual(['User'], stats.n_plus_one())
+
+    def test_accounted_endpoint_adds_to_totals(self):
+        # 0.arrange
+        container = NEW_GAME_REQUEST.combined_message_class(user_name="lisa")
+        # 1.acion
+        self.api.new_game(container)
+        self.api.new_game(container)
+        # 2.assert
+        rpcstats.flush()
+        totals = rpcstats.totals(['new_game'])['new_game']
+        self.assertEqual(2, totals['calls'])
+        self.assertEqual(2, totals['put'])
+        self.assertEqual(0, totals['n_plus_one'])
+
+    def test_admin_handler_reports_endpoints(self):
+        # 0.arrange
+        self.api.new_game(NEW_GAME_REQUEST.combined_message_class(
+            user_name="lisa"))
+        # 1.acion
+        response = main.webapp2.Request.blank(
+            '/admin/rpcstats?reset=1').get_response(main.app)
+        # 2.assert
+        self.assertEqual(200, response.status_int)
+        self.assertIn('new_game', response.body)
+        self.assertEqual(0, rpcstats.totals(['new_game'])['new_game']['calls'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+import sys
+sys.path.append("..")
+from TicTacToe import simulate
+
+
+class SimulateTestCase(unittest.TestCase):
+
+    def test_perfect_play_always_draws(self):
+        # 0.arrange
+        matchups = [("PERFECT", "PERFECT")]
+        # 1.acion
+        result = simulate.run(matchups, 50, processes=1)
+        # 2.assert
+        stats = result["PERFECT:PERFECT"]
+        self.assertEqual(50, stats["draws"])
+        self.assertEqual(9.0, stats["average_moves"])
+
+    def test_totals_add_up(self):
+        # 0.arrange
+        matchups = [("EASY", "MEDIUM")]
+        # 1.acion
+        stats = simulate.run(matchups, 200, processes=1,
+                             shard_size=30)["EASY:MEDIUM"]
+        # 2.assert
+        self.assertEqual(200, stats["x_wins"] + stats["o_wins"] +
+                         stats["draws"])
+        self.assertEqual(200, sum(entry["games"] for entry in
+                                  stats["first_moves"].values()))
+
+    def test_runs_are_reproducible_across_processes(self):
+        # 0.arrange
+        matchups = [("EASY", "EASY"), ("MEDIUM", "PERFECT")]
+        # 1.acion
+        serial = simulate.run(matchups, 300, processes=1, shard_size=50,
+                              seed=3)
+        pooled = simulate.run(matchups, 300, processes=2, shard_size=50,
+                              seed=3)
+        # 2.assert
+        self.assertEqual(serial, pooled)
+        self.assertNotEqual(serial, simulate.run(
+            matchups, 300, processes=1, shard_size=50, seed=4))
+
+    def test_large_board(self):
+        # 0.arrange
+        matchups = [("MEDIUM", "EASY")]
+        # 1.acion
+        stats = simulate.run(matchups, 20, processes=1, size=7,
+                             k=4)["MEDIUM:EASY"]
+        # 2.assert
+        self.assertEqual(20, stats["games"])
+
+
+if __name__=='__main__':
+    unittest.main()